@@ -1,5 +1,3 @@
-import usb.core
-import usb.util
 from time import sleep
 from warnings import warn
 import platform
@@ -15,8 +13,19 @@ class ParticularsLaserController:
 	sent to me after request. I did not 
 	implemented every feature, only what I need.
 	"""
-	def __init__(self):
-		device = usb.core.find(idVendor=0xC251, idProduct=0x2201) # ID c251:2201 Keil Software, Inc. LASER Driver IJS
+	def __init__(self, device=None):
+		"""Create an instance of `ParticularsLaserController`.
+		
+		Parameters
+		----------
+		device: optional
+			The USB device of the laser controller. If `None` it is 
+			searched for. Useful to pass e.g. a `SimulatedLaserUSBDevice`
+			from `simulation.py` to work without the real laser.
+		"""
+		if device is None:
+			import usb.core # Here and not at the top so PyUSB is only needed if the laser is used.
+			device = usb.core.find(idVendor=0xC251, idProduct=0x2201) # ID c251:2201 Keil Software, Inc. LASER Driver IJS
 		if device is None:
 			raise RuntimeError(f'Cannot find the laser controller within the USB devices. Be sure it is connected and that it is recognized by the computer.')
 		if platform.system() == 'Linux':
@@ -41,15 +50,7 @@ class ParticularsLaserController:
 	@frequency.setter
 	def frequency(self, Hz: float):
 		"""Set the frequency in Hz."""
-		try:
-			Hz = float(Hz)
-		except:
-			raise TypeError(f'`Hz` must be a number, received object of type {type(Hz)}.')
-		if hasattr(Hz, '__iter__'): # This is to prevent numpy arrays that will pass the previous check.
-			raise TypeError(f'`Hz` must be a number, received object of type {type(Hz)}.')
-		if not 50 <= Hz <= 100e3:
-			raise ValueError(f'`Hz` must be within 50 and 100e3, received {Hz} Hz.')
-		self._frequency = Hz
+		self._frequency = self._check_frequency(Hz)
 		if self.status == 'on':
 			self._turn_on() # This is to force an update of the frequency.
 	
@@ -66,13 +67,62 @@ class ParticularsLaserController:
 		DAC: int
 			Value for the DAC, from 0 (highest intensity) to 1023.
 		"""
+		self._DAC = self._check_DAC(DAC)
+		if self.status == 'on':
+			self._turn_on() # This is to force an update on the DAC.
+	
+	@staticmethod
+	def _check_frequency(Hz):
+		"""Raise an error if `Hz` is not a valid frequency, otherwise
+		return it as a float."""
+		if hasattr(Hz, '__iter__'): # This is to prevent numpy arrays that will pass the check below.
+			raise TypeError(f'`Hz` must be a number, received object of type {type(Hz)}.')
+		try:
+			Hz = float(Hz)
+		except:
+			raise TypeError(f'`Hz` must be a number, received object of type {type(Hz)}.')
+		if not 50 <= Hz <= 100e3:
+			raise ValueError(f'`Hz` must be within 50 and 100e3, received {Hz} Hz.')
+		return Hz
+	
+	@staticmethod
+	def _check_DAC(DAC):
+		"""Raise an error if `DAC` is not a valid DAC value, otherwise
+		return it."""
 		if not isinstance(DAC, int):
 			raise TypeError(f'`DAC` must be an integer number.')
 		if not 0 <= DAC < 1024:
 			raise ValueError(f'`DAC` must be in [0,1024).')
+		return DAC
+	
+	def set(self, frequency: float=None, DAC: int=None, status: str=None):
+		"""Change several settings of the laser at once. This is faster
+		than changing them one by one because the new configuration is
+		sent to the laser controller only once. Arguments that are `None`
+		are not changed.
+		
+		Parameters
+		----------
+		frequency: float, optional
+			Frequency in Hz, see `frequency`.
+		DAC: int, optional
+			Value for the DAC, see `DAC`.
+		status: str, optional
+			Either `'on'` or `'off'`.
+		"""
+		if status is not None and status not in {'on','off'}:
+			raise ValueError(f'`status` must be either "on" or "off", received {repr(status)}.')
+		frequency = self.frequency if frequency is None else self._check_frequency(frequency)
+		DAC = self.DAC if DAC is None else self._check_DAC(DAC)
+		current_status = self.status
+		changed = (frequency, DAC) != (self.frequency, self.DAC)
+		self._frequency = frequency
 		self._DAC = DAC
-		if self.status == 'on':
-			self._turn_on() # This is to force an update on the DAC.
+		new_status = current_status if status is None else status
+		if new_status == 'on' and (changed or current_status == 'off'):
+			self._turn_on()
+		elif new_status == 'off' and current_status == 'on':
+			self._turn_off()
 	
 	@property
 	def status(self):
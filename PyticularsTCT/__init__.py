@@ -1,9 +1,27 @@
-from .stage import TCTStages
+from .stage import TCTStages, _construct_concurrently
 from .ParticularsLaserController import ParticularsLaserController
 import platform
-	
+import time
+
 class TCT:
 	"""Just a container for both the stages and the laser."""
-	def __init__(self, x_stage_port, y_stage_port, z_stage_port):
-		self.stages = TCTStages(x_stage_port, y_stage_port, z_stage_port)
-		self.laser = ParticularsLaserController()
+	def __init__(self, x_stage_port, y_stage_port, z_stage_port, stages_backend=None, laser_device=None):
+		time_started = time.perf_counter()
+		devices, times = _construct_concurrently({ # The stages and the laser are opened at the same time.
+			'stages': lambda: TCTStages(x_stage_port, y_stage_port, z_stage_port, backend=stages_backend), # For `stages_backend` see `Stage`.
+			'laser': lambda: ParticularsLaserController(device=laser_device), # For `laser_device` see `ParticularsLaserController`.
+		})
+		self.stages = devices['stages']
+		self.laser = devices['laser']
+		self.startup_times = { # Seconds that each part of the construction took, useful to see what is slow.
+			**{name: t for name,t in self.stages.startup_times.items() if name != 'total'},
+			'stages': times['stages'],
+			'laser': times['laser'],
+			'total': time.perf_counter() - time_started,
+		}
+
+def __getattr__(name):
+	if name == 'AsyncTCT': # Imported only when needed, so `import PyticularsTCT` does not import `asyncio`.
+		from .async_tct import AsyncTCT
+		return AsyncTCT
+	raise AttributeError(f'module {repr(__name__)} has no attribute {repr(name)}')
@@ -0,0 +1,231 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class _DeviceExecutor:
+	"""Runs the (blocking) calls to one device in a thread dedicated to
+	that device. This way the calls to each device are executed one
+	after the other, while different devices work at the same time."""
+	def __init__(self, name: str):
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'PyticularsTCT_{name}')
+	
+	async def run(self, function, *args, **kwargs):
+		"""Run `function(*args, **kwargs)` in the thread of this device
+		and return its result."""
+		return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+	
+	def shutdown(self):
+		self._executor.shutdown(wait=True)
+
+class AsyncStage:
+	"""Wrapper of a `Stage` with awaitable methods."""
+	def __init__(self, stage, name: str='stage'):
+		"""Create an instance of `AsyncStage`.
+		
+		Parameters
+		----------
+		stage: Stage
+			The stage to wrap.
+		name: str, default 'stage'
+			Name used for the thread of this stage.
+		"""
+		self.stage = stage
+		self._executor = _DeviceExecutor(name)
+	
+	async def move_to(self, m: float):
+		"""Move the stage to some absolute position, in meters. See `Stage.move_to`."""
+		await self._executor.run(self.stage.move_to, m, blocking=True)
+	
+	async def move_rel(self, m: float):
+		"""Move the stage relative to the current position, in meters. See `Stage.move_rel`."""
+		await self._executor.run(self.stage.move_rel, m, blocking=True)
+	
+	async def wait_for_stop(self):
+		"""Wait until the stage stops moving."""
+		await self._executor.run(self.stage.wait_for_stop)
+	
+	async def position(self):
+		"""Return the position of the stage in meters."""
+		return await self._executor.run(lambda: self.stage.position)
+	
+	async def get_status(self, format: str='dict'):
+		"""See `Stage.get_status`. Note that for `format='numpy'` the
+		returned array is overwritten in each call."""
+		return await self._executor.run(self.stage.get_status, format)
+	
+	async def reset_position(self):
+		"""See `Stage.reset_position`."""
+		await self._executor.run(self.stage.reset_position)
+	
+	def close(self):
+		"""Stop the thread of this stage, the stage itself is not closed."""
+		self._executor.shutdown()
+
+class AsyncTCTStages:
+	"""Wrapper of a `TCTStages` with awaitable methods. Each of the stages
+	has its own thread, so the three axes move at the same time and e.g.
+	the position of one stage can be read while another is moving."""
+	def __init__(self, stages):
+		"""Create an instance of `AsyncTCTStages`.
+		
+		Parameters
+		----------
+		stages: TCTStages
+			The stages to wrap.
+		"""
+		self.stages = stages
+		self.x_stage = AsyncStage(stages.x_stage, name='x_stage')
+		self.y_stage = AsyncStage(stages.y_stage, name='y_stage')
+		self.z_stage = AsyncStage(stages.z_stage, name='z_stage')
+		self._async_stages = [self.x_stage, self.y_stage, self.z_stage]
+	
+	async def _command_stages(self, steps, relative: bool):
+		# Async version of `TCTStages._command_stages`, each stage is moved from its own thread.
+		previous_position = [self.stages._cached_coordinate(i) for i in range(3)]
+		try:
+			await asyncio.gather(*[
+				async_stage._executor.run(self.stages._select_motion_profiles, [steps_usteps if i==j else None for j in range(3)], relative)
+				for i,(async_stage, steps_usteps) in enumerate(zip(self._async_stages, steps)) if steps_usteps is not None
+			])
+			time_started = time.monotonic()
+			await asyncio.gather(*[
+				async_stage._executor.run(
+					async_stage.stage._move_rel if relative else async_stage.stage._move_to,
+					*steps_usteps,
+					blocking = True,
+				)
+				for async_stage, steps_usteps in zip(self._async_stages, steps) if steps_usteps is not None
+			])
+		except:
+			for i,steps_usteps in enumerate(steps): # We don't know where these stages ended.
+				if steps_usteps is not None:
+					self.stages._position_cache[i] = None
+			raise
+		duration = time.monotonic() - time_started
+		if self.stages._update_position_cache(steps, relative, previous_position):
+			await asyncio.get_running_loop().run_in_executor(None, self.stages._verify_position_cache, [i for i,steps_usteps in enumerate(steps) if steps_usteps is not None])
+		if any(steps_usteps is not None for steps_usteps in steps):
+			self.stages._record_move_duration(previous_position, duration)
+	
+	async def move_to(self, x: float=None, y: float=None, z: float=None):
+		"""Move the stages to an absolute position, all of them at the
+		same time. See `TCTStages.move_to`."""
+		self.stages._check_limits(x, y, z)
+		await self._command_stages([None if pos is None else stage.calibration.m2steps(pos) for stage,pos in zip(self.stages._stages, [x,y,z])], relative=False)
+	
+	async def move_rel(self, x: float=None, y: float=None, z: float=None):
+		"""Move the stages relative to the current position, all of them
+		at the same time. See `TCTStages.move_rel`."""
+		displacement = [None if xyz is None or stage.calibration.m2steps(xyz, relative=True) == (0,0) else xyz for stage,xyz in zip(self.stages._stages, [x,y,z])]
+		if all(d is None for d in displacement):
+			return
+		current_position = await self.commanded_position()
+		self.stages._check_limits(*[None if d is None else pos+d for pos,d in zip(current_position, displacement)])
+		await self._command_stages([None if d is None else stage.calibration.m2steps(d, relative=True) for stage,d in zip(self.stages._stages, displacement)], relative=True)
+	
+	async def position(self):
+		"""Return the current position `(x,y,z)` of the stages in meters,
+		reading the three stages at the same time."""
+		return tuple(await asyncio.gather(*[async_stage.position() for async_stage in self._async_stages]))
+	
+	async def commanded_position(self):
+		"""See `TCTStages.commanded_position`."""
+		position = [self.stages._cached_coordinate(i) for i in range(3)]
+		if any(pos is None for pos in position):
+			readings = await asyncio.gather(*[async_stage._executor.run(async_stage.stage._read_position_and_stopped) for async_stage in self._async_stages])
+			self.stages._set_position_cache([pos if stopped else None for pos,stopped in readings])
+			position = [pos for pos,stopped in readings]
+		return tuple(position)
+	
+	async def reset_position(self):
+		"""See `TCTStages.reset_position`."""
+		for async_stage in self._async_stages: # One after the other, as in `TCTStages.reset_position`.
+			await async_stage.reset_position()
+			await async_stage.wait_for_stop()
+		self.stages.invalidate_position_cache()
+	
+	def close(self):
+		"""Stop the threads of the stages, the stages themselves are not closed."""
+		for async_stage in self._async_stages:
+			async_stage.close()
+
+class AsyncLaser:
+	"""Wrapper of a `ParticularsLaserController` with awaitable methods."""
+	def __init__(self, laser):
+		"""Create an instance of `AsyncLaser`.
+		
+		Parameters
+		----------
+		laser: ParticularsLaserController
+			The laser to wrap.
+		"""
+		self.laser = laser
+		self._executor = _DeviceExecutor('laser')
+	
+	async def set(self, frequency: float=None, DAC: int=None, status: str=None):
+		"""Change several settings at once, see `ParticularsLaserController.set`."""
+		await self._executor.run(self.laser.set, frequency=frequency, DAC=DAC, status=status)
+	
+	async def on(self):
+		"""Turn the laser on."""
+		await self._executor.run(self.laser.on)
+	
+	async def off(self):
+		"""Turn the laser off."""
+		await self._executor.run(self.laser.off)
+	
+	async def status(self):
+		"""Return either `'on'` or `'off'`."""
+		return await self._executor.run(lambda: self.laser.status)
+	
+	async def frequency(self):
+		"""Return the current value of the frequency in Hz."""
+		return await self._executor.run(lambda: self.laser.frequency)
+	
+	async def DAC(self):
+		"""Return the current value of the DAC."""
+		return await self._executor.run(lambda: self.laser.DAC)
+	
+	def close(self):
+		"""Stop the thread of the laser, the laser itself is not closed."""
+		self._executor.shutdown()
+
+class AsyncTCT:
+	"""Wrapper of a `TCT` with awaitable methods, so an acquisition
+	coroutine can run while the stages move and the laser is being
+	configured. Each device (each stage and the laser) is operated from
+	its own thread. Usage example:
+	```
+	async def main():
+		async with AsyncTCT(PyticularsTCT.TCT(...)) as tct:
+			await asyncio.gather(
+				tct.stages.move_to(x=1e-3, y=2e-3),
+				tct.laser.set(frequency=1e3, DAC=0, status='on'),
+			)
+			print(await tct.stages.position())
+	asyncio.run(main())
+	```
+	"""
+	def __init__(self, tct):
+		"""Create an instance of `AsyncTCT`.
+		
+		Parameters
+		----------
+		tct: TCT
+			The TCT to wrap.
+		"""
+		self.tct = tct
+		self.stages = AsyncTCTStages(tct.stages)
+		self.laser = AsyncLaser(tct.laser)
+	
+	def close(self):
+		"""Stop all the threads, the devices themselves are not closed."""
+		self.stages.close()
+		self.laser.close()
+	
+	async def __aenter__(self):
+		return self
+	
+	async def __aexit__(self, exc_type, exc_value, traceback):
+		self.close()
@@ -1,5 +1,9 @@
 from pathlib import Path
-import serial.tools.list_ports
+import json
+
+CACHE_FILE_PATH = Path.home()/Path('.PyticularsTCT')/Path('ximc_stages_ports.json') # Remembers in which port each stage was found the last time.
+SERIAL_BY_ID_PATH = Path('/dev/serial/by-id') # Linux, links with the serial number in their names pointing to the ports.
+SYS_CLASS_TTY_PATH = Path('/sys/class/tty') # Linux, information about each port.
 
 def find_ximc_serial_devices():
 	"""Find all the XIMC devices connected via USB to your computer.
@@ -16,9 +20,108 @@ def find_ximc_serial_devices():
 		]
 		```
 	"""
+	import serial.tools.list_ports # Here and not at the top so pyserial is only needed when the cache and the direct lookup are not enough.
 	return [{'manufacturer': p.manufacturer, 'description': p.description, 'port': p.device, 'serial_number': p.serial_number} for p in serial.tools.list_ports.comports() if 'XIMC' == p.manufacturer]
 
-def map_coordinates_to_serial_ports(stages_coordinates: dict):
+def _short_serial_number(serial_number: str):
+	# Serial numbers are reported either as e.g. `'00003A57'` or as `'XIMC_XIMC_Motor_Controller_00003A57'`, this returns the first form.
+	return serial_number.split('_')[-1].upper()
+
+def _serial_number_of_port(port: str):
+	"""Read the serial number of the USB device of `port` from sysfs,
+	without opening it. Returns `None` if it cannot be read, e.g. the
+	port does not exist, it is not a USB device or this is not Linux."""
+	try:
+		device_path = (SYS_CLASS_TTY_PATH/Path(port).name/Path('device')).resolve(strict=True)
+	except (OSError, RuntimeError):
+		return None
+	for path in [device_path, *device_path.parents]: # The serial number is in the USB device, which is a parent of the interface of the port.
+		if (path/Path('serial')).is_file():
+			try:
+				return (path/Path('serial')).read_text().strip()
+			except OSError:
+				return None
+		if path == SYS_CLASS_TTY_PATH.parent.parent: # Reached `/sys` without finding it.
+			break
+	return None
+
+def _port_from_serial_by_id(serial_number: str):
+	"""Find the port of the stage with `serial_number` using the links in
+	`/dev/serial/by-id`, which are named after the serial number. Returns
+	`None` if it is not found there."""
+	try:
+		links = list(SERIAL_BY_ID_PATH.iterdir())
+	except OSError:
+		return None
+	for link in links:
+		if 'XIMC' in link.name and _short_serial_number(serial_number) in link.name.upper():
+			try:
+				return str(link.resolve(strict=True))
+			except (OSError, RuntimeError):
+				pass
+	return None
+
+def _load_cache():
+	try:
+		with open(CACHE_FILE_PATH) as ifile:
+			cache = json.load(ifile)
+	except (OSError, ValueError):
+		return {}
+	return cache if isinstance(cache, dict) else {}
+
+def _save_cache(cache: dict):
+	try:
+		CACHE_FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
+		with open(CACHE_FILE_PATH, 'w') as ofile:
+			json.dump(cache, ofile, indent=2)
+	except OSError:
+		pass # Not being able to write the cache only means that the next time it will be slower.
+
+def find_ports_of_ximc_stages(serial_numbers, use_cache: bool=True):
+	"""Find the port to which each stage is connected. The ports are
+	looked for, in this order:
+	1. In the cache from the last time, if the port still belongs to
+	the same stage, which is checked without opening it.
+	2. In the `/dev/serial/by-id` links (Linux).
+	3. Enumerating all the serial ports with `find_ximc_serial_devices`,
+	only if some stage was not found yet.
+	
+	Arguments
+	---------
+	serial_numbers: list of str
+		Serial numbers of the stages, e.g. `['00003A57','00003A48']`.
+	use_cache: bool, default True
+		If `False` the cache is not read, though it is still updated.
+	
+	Returns
+	-------
+	ports: dict
+		A dictionary mapping each serial number to its port, e.g.
+		`{'00003A57': '/dev/ttyACM2', '00003A48': '/dev/ttyACM0'}`.
+		Stages that were not found are not included.
+	"""
+	cache = _load_cache()
+	ports = {}
+	for serial_number in serial_numbers:
+		short_serial_number = _short_serial_number(serial_number)
+		cached_port = cache.get(short_serial_number) if use_cache else None
+		if cached_port is not None and _short_serial_number(_serial_number_of_port(cached_port) or '') == short_serial_number:
+			ports[serial_number] = cached_port
+			continue
+		port = _port_from_serial_by_id(serial_number)
+		if port is not None:
+			ports[serial_number] = port
+	if len(ports) < len(serial_numbers): # Not found with the cheap methods, enumerate everything.
+		found = {_short_serial_number(device['serial_number']): device['port'] for device in find_ximc_serial_devices() if device['serial_number'] is not None}
+		for serial_number in serial_numbers:
+			if serial_number not in ports and _short_serial_number(serial_number) in found:
+				ports[serial_number] = found[_short_serial_number(serial_number)]
+	updated_cache = {**cache, **{_short_serial_number(serial_number): port for serial_number,port in ports.items()}}
+	if updated_cache != cache:
+		_save_cache(updated_cache)
+	return ports
+
+def map_coordinates_to_serial_ports(stages_coordinates: dict, use_cache: bool=True):
 	"""Returns a dictionary with the mapping of which coordinate is connected
 	to each serial port.
 	
@@ -37,6 +140,8 @@ def map_coordinates_to_serial_ports(stages_coordinates: dict):
 		If you don't know how to find the ID of each controller, have 
 		a look at the script `list_usb_serial_ports.sh` which should be
 		in the same directory as this file.
+	use_cache: bool, default True
+		See `find_ports_of_ximc_stages`.
 	
 	Returns
 	-------
@@ -46,9 +151,9 @@ def map_coordinates_to_serial_ports(stages_coordinates: dict):
 		{'x': '/dev/ttyACM2', 'y': '/dev/ttyACM3', 'z': '/dev/ttyACM1'}
 		```
 	"""
-	coordinates_mapping_to_ports = {}
-	for device in find_ximc_serial_devices():
-		coordinates_mapping_to_ports[stages_coordinates[device['serial_number']]] = device['port']
-	if any([not coord in coordinates_mapping_to_ports for coord in {'x','y','z'}]):
-		raise RuntimeError(f'Cannot find the connections of the stages.')
+	ports = find_ports_of_ximc_stages(list(stages_coordinates), use_cache=use_cache)
+	coordinates_mapping_to_ports = {coordinate: ports[serial_number] for serial_number,coordinate in stages_coordinates.items() if serial_number in ports}
+	missing = {coord: [serial_number for serial_number,c in stages_coordinates.items() if c == coord] for coord in ['x','y','z'] if coord not in coordinates_mapping_to_ports}
+	if len(missing) > 0:
+		raise RuntimeError(f'Cannot find the stages for coordinates {sorted(missing)}, with serial numbers {missing}. Be sure they are connected and powered.')
 	return coordinates_mapping_to_ports
@@ -0,0 +1,201 @@
+import time
+import json
+import os
+import bisect
+import threading
+from collections import deque
+
+HISTOGRAM_BIN_EDGES = [10**(e/4) for e in range(-24, 5)] # From 1 µs to 10 s, 4 bins per decade.
+
+class Instrumentation:
+	"""Measures the time spent in each call to the ximc library made by
+	the stages and in each USB transfer to the laser. Nothing is
+	measured (and there is no overhead at all) unless it is attached to
+	some device. Usage example:
+	```
+	with Instrumentation().attach(tct) as instrumentation:
+		for position in tct.stages.scan(...):
+			...
+	instrumentation.print_summary()
+	instrumentation.export_chrome_trace('trace.json') # Open it in chrome://tracing or https://ui.perfetto.dev
+	```
+	"""
+	def __init__(self, trace_capacity: int=100000):
+		"""Create an instance of `Instrumentation`.
+		
+		Parameters
+		----------
+		trace_capacity: int, default 100000
+			Number of calls kept for `export_chrome_trace`, the older ones
+			are discarded. Counts and timings in `summary` include all.
+		"""
+		self._lock = threading.Lock()
+		self._time_origin = time.perf_counter()
+		self._statistics = {} # `{(device, function): [count, total_time, histogram]}`.
+		self._trace = deque(maxlen=trace_capacity)
+		self._detach_functions = []
+	
+	def record(self, device: str, function: str, start: float, duration: float):
+		"""Record one call that started at `start` (from `time.perf_counter()`)
+		and took `duration` seconds."""
+		with self._lock:
+			statistics = self._statistics.get((device, function))
+			if statistics is None:
+				statistics = self._statistics[(device, function)] = [0, 0., [0]*(len(HISTOGRAM_BIN_EDGES)+1)]
+			statistics[0] += 1
+			statistics[1] += duration
+			statistics[2][bisect.bisect(HISTOGRAM_BIN_EDGES, duration)] += 1
+			self._trace.append((device, function, start, duration, threading.get_ident()))
+	
+	def _wrap(self, function, device: str, name: str):
+		record = self.record
+		perf_counter = time.perf_counter
+		def wrapper(*args, **kwargs):
+			start = perf_counter()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				record(device, name, start, perf_counter()-start)
+		return wrapper
+	
+	# Attaching to the devices ---
+	
+	def attach(self, obj, name: str=None):
+		"""Start measuring the calls of `obj`, which can be a `TCT`, a
+		`TCTStages`, a `Stage` or a `ParticularsLaserController`. Returns
+		`self`, so it can be used in a `with` statement to detach at the
+		end.
+		
+		Parameters
+		----------
+		obj:
+			What to measure.
+		name: str, optional
+			Name of the device in the results. By default the port for
+			the stages and `'laser'` for the laser.
+		"""
+		if hasattr(obj, 'stages') and hasattr(obj, 'laser'): # A `TCT`.
+			self.attach(obj.stages)
+			self.attach(obj.laser)
+		elif hasattr(obj, '_stages'): # A `TCTStages`.
+			for coordinate, stage in zip(['x','y','z'], obj._stages):
+				self.attach(stage, name=f'{coordinate} stage ({stage.port})')
+		elif hasattr(obj, '_lib'): # A `Stage`.
+			self._attach_stage(obj, obj.port if name is None else name)
+		elif hasattr(obj, 'endpoint') and hasattr(obj, 'device'): # A `ParticularsLaserController`.
+			self._attach_laser(obj, 'laser' if name is None else name)
+		else:
+			raise TypeError(f'Cannot attach to an object of type {type(obj)}.')
+		return self
+	
+	def _attach_stage(self, stage, name: str):
+		if isinstance(stage._lib, _InstrumentedProxy):
+			raise RuntimeError(f'The stage in port {repr(stage.port)} is already attached to an `Instrumentation`, detach it first.')
+		original_lib = stage._lib
+		stage._lib = _InstrumentedProxy(original_lib, self, name, prefix='lib.')
+		def detach():
+			stage._lib = original_lib
+		self._detach_functions.append(detach)
+	
+	def _attach_laser(self, laser, name: str):
+		if isinstance(laser.device, _InstrumentedProxy):
+			raise RuntimeError(f'The laser is already attached to an `Instrumentation`, detach it first.')
+		original_device, original_endpoint = laser.device, laser.endpoint
+		original_send_packet = vars(laser).get('_send_packet') # Only if it was replaced in the instance, usually it is the method of the class.
+		laser.device = _InstrumentedProxy(original_device, self, name, only={'ctrl_transfer'}, prefix='device.')
+		laser.endpoint = _InstrumentedProxy(original_endpoint, self, name, only={'read'}, prefix='endpoint.')
+		laser._send_packet = self._wrap(laser._send_packet, name, '_send_packet') # This includes the `sleep` after each packet.
+		def detach():
+			laser.device, laser.endpoint = original_device, original_endpoint
+			if original_send_packet is None:
+				vars(laser).pop('_send_packet', None) # Back to the method of the class.
+			else:
+				laser._send_packet = original_send_packet
+		self._detach_functions.append(detach)
+	
+	def detach(self):
+		"""Stop measuring, the devices are left as they were before
+		`attach`. What was measured is kept."""
+		while self._detach_functions:
+			self._detach_functions.pop()()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.detach()
+	
+	# Results ---
+	
+	def reset(self):
+		"""Forget everything that was measured."""
+		with self._lock:
+			self._statistics.clear()
+			self._trace.clear()
+	
+	def summary(self):
+		"""Returns a dictionary of the form
+		```
+		{device: {function: {'count': int, 'total_time': float, 'mean_time': float, 'histogram': list of int}}}
+		```
+		with times in seconds. The bin edges of the histograms are in
+		`HISTOGRAM_BIN_EDGES`, the first bin is for calls faster than the
+		first edge and the last bin for calls slower than the last edge.
+		"""
+		with self._lock:
+			summary = {}
+			for (device, function), (count, total_time, histogram) in sorted(self._statistics.items()):
+				summary.setdefault(device, {})[function] = {
+					'count': count,
+					'total_time': total_time,
+					'mean_time': total_time/count,
+					'histogram': list(histogram),
+				}
+			return summary
+	
+	def print_summary(self):
+		"""Print a table with the time spent in each function of each
+		device, from the most to the least time consuming."""
+		rows = [(device, function, s['count'], s['total_time'], s['mean_time']) for device, functions in self.summary().items() for function, s in functions.items()]
+		print(f'{"device":<30} {"function":<40} {"count":>8} {"total (s)":>10} {"mean (µs)":>10}')
+		for device, function, count, total_time, mean_time in sorted(rows, key=lambda row: -row[3]):
+			print(f'{device:<30} {function:<40} {count:>8} {total_time:>10.4f} {mean_time*1e6:>10.1f}')
+	
+	def export_chrome_trace(self, path):
+		"""Save the calls as a timeline in the Chrome trace event format,
+		which can be opened in `chrome://tracing` or https://ui.perfetto.dev."""
+		with self._lock:
+			events = [
+				{
+					'name': function,
+					'cat': device,
+					'ph': 'X',
+					'ts': (start-self._time_origin)*1e6,
+					'dur': duration*1e6,
+					'pid': os.getpid(),
+					'tid': thread,
+					'args': {'device': device},
+				}
+				for device, function, start, duration, thread in self._trace
+			]
+		with open(path, 'w') as ofile:
+			json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, ofile)
+
+class _InstrumentedProxy:
+	# Forwards everything to `target`, measuring the time of the calls to its functions (or only to those in `only`).
+	def __init__(self, target, instrumentation, device: str, only=None, prefix: str=''):
+		self._target = target
+		self._instrumentation = instrumentation
+		self._device = device
+		self._only = only
+		self._prefix = prefix
+	
+	def __getattr__(self, name):
+		attribute = getattr(self._target, name)
+		if callable(attribute) and (self._only is None or name in self._only):
+			attribute = self._instrumentation._wrap(attribute, self._device, self._prefix+name)
+			setattr(self, name, attribute) # So next time `__getattr__` is not even called.
+		return attribute
+	
+	def __getitem__(self, i):
+		return self._target[i]
@@ -0,0 +1,263 @@
+import threading
+import time
+import ctypes
+import warnings
+import numpy as np
+from .ximc import pyximc
+
+class _StatusSampler:
+	"""Reads the status of a stage periodically from a background thread.
+	It has its own `status_t` buffer, so it does not interfere with the
+	buffer of the stage used by the main thread. Subclasses implement
+	`_store` to do something with each reading. If reading the status
+	fails the sampling stops, a warning is issued and the exception is
+	kept in `last_error`."""
+	def __init__(self, stage, interval: float):
+		if not interval >= 0:
+			raise ValueError(f'`interval` must be a non negative number of seconds, received {repr(interval)}.')
+		self.stage = stage
+		self.interval = interval
+		self._status = pyximc.status_t()
+		self._status_ref = ctypes.byref(self._status)
+		self._stop_event = threading.Event()
+		self._thread = None
+		self.last_error = None # The exception that stopped the sampling, if any.
+	
+	def start(self):
+		"""Start sampling in the background."""
+		if self.is_running:
+			raise RuntimeError(f'The sampler is already running.')
+		self._stop_event.clear()
+		self.last_error = None
+		self._thread = threading.Thread(target=self._run, daemon=True, name=f'{type(self).__name__}_{self.stage.port}')
+		self._thread.start()
+	
+	def stop(self):
+		"""Stop sampling and wait for the background thread to finish."""
+		self._stop_event.set()
+		if self._thread is not None:
+			self._thread.join()
+	
+	@property
+	def is_running(self):
+		"""`False` once it was stopped, including because of an error 
+		(see `last_error`)."""
+		return self._thread is not None and self._thread.is_alive()
+	
+	def _run(self):
+		next_sample_time = time.monotonic()
+		while not self._stop_event.is_set():
+			try:
+				before = time.monotonic()
+				self.stage._lib.get_status(self.stage._dev_id, self._status_ref)
+				after = time.monotonic()
+				if self._store((before+after)/2, self._status) == False: # The reading happened somewhere in between `before` and `after`.
+					break
+			except Exception as e: # E.g. a `bindings.XimcError` because the stage was disconnected.
+				self.last_error = e
+				warnings.warn(f'`{type(self).__name__}` of stage in port {repr(self.stage.port)} stopped because of an error: {repr(e)}')
+				break
+			next_sample_time += self.interval
+			if next_sample_time < after: # We are late, don't try to catch up.
+				next_sample_time = after
+			self._stop_event.wait(next_sample_time - after)
+	
+	def _store(self, timestamp: float, status):
+		"""Do something with one reading of the status. Return `False`
+		to stop sampling."""
+		raise NotImplementedError()
+	
+	def __enter__(self):
+		self.start()
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.stop()
+
+class PositionSampler(_StatusSampler):
+	"""Records `(time.monotonic(), position)` of a stage into preallocated
+	arrays from a background thread. Usage example:
+	```
+	with PositionSampler(stage, interval=1e-3, capacity=100000) as sampler:
+		stage.move_to(1e-3)
+	positions = sampler.position_at(my_timestamps) # `my_timestamps` from `time.monotonic()`.
+	```
+	"""
+	def __init__(self, stage, interval: float=1e-3, capacity: int=100000):
+		"""Create an instance of `PositionSampler`.
+		
+		Parameters
+		----------
+		stage: Stage
+			The stage to sample.
+		interval: float, default 1e-3
+			Time between samples, in seconds. Use 0 to sample as fast as
+			possible.
+		capacity: int, default 100000
+			Maximum number of samples. When the arrays are full the
+			sampling stops and a warning is issued.
+		"""
+		super().__init__(stage, interval)
+		self._times = np.empty(capacity, dtype=float)
+		self._positions = np.empty(capacity, dtype=float)
+		self._count = 0
+	
+	def _store(self, timestamp, status):
+		if self._count >= len(self._times):
+			warnings.warn(f'`PositionSampler` of stage in port {repr(self.stage.port)} is full after {self._count} samples, sampling stops.')
+			return False
+		self._times[self._count] = timestamp
+		self._positions[self._count] = self.stage.calibration.steps2m(status.CurPosition, status.uCurPosition)
+		self._count += 1
+	
+	@property
+	def times(self):
+		"""Array with the time of each sample, as given by `time.monotonic()`."""
+		return self._times[:self._count]
+	
+	@property
+	def positions(self):
+		"""Array with the position of the stage in each sample, in meters."""
+		return self._positions[:self._count]
+	
+	def position_at(self, timestamps):
+		"""Return the position of the stage at each of `timestamps`,
+		interpolating linearly between the samples.
+		
+		Parameters
+		----------
+		timestamps: float or array like of float
+			Times as given by `time.monotonic()`.
+		
+		Returns
+		-------
+		position: float or numpy array
+			Position in meters at each of `timestamps`. Timestamps outside
+			the sampled period get NaN.
+		"""
+		count = self._count # Read it only once, the thread may still be writing.
+		if count < 2:
+			raise RuntimeError(f'Not enough samples to interpolate, there are {count}.')
+		return np.interp(timestamps, self._times[:count], self._positions[:count], left=np.nan, right=np.nan)
+
+class FlyScan:
+	"""A movement of one stage at constant speed while its position is
+	being sampled. Created by `TCTStages.fly_scan`, see there."""
+	def __init__(self, stage, sampler, on_finish):
+		self.stage = stage
+		self.sampler = sampler
+		self._on_finish = on_finish
+		self._finished = False
+	
+	def wait(self):
+		"""Block until the stage arrives to the end of the scan, then stop
+		the sampler and restore the motion profile of the stage."""
+		if self._finished:
+			return
+		try:
+			self.stage.wait_for_stop()
+		except:
+			self.sampler.stop()
+			self._finished = True
+			self._on_finish(completed=False)
+			raise
+		self.sampler.stop()
+		self._finished = True
+		self._on_finish(completed=True)
+	
+	@property
+	def is_moving(self):
+		return not self._finished and self.stage.get_status(format='tuple')[2]
+	
+	def position_at(self, timestamps):
+		"""Position of the stage, in meters, at each of `timestamps` as
+		given by `time.monotonic()`. See `PositionSampler.position_at`."""
+		return self.sampler.position_at(timestamps)
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.wait()
+
+class TelemetryRecorder(_StatusSampler):
+	"""Records the status of a stage at a fixed rate into a ring buffer,
+	so memory is constant no matter how long it runs. When the buffer 
+	is full the oldest records are overwritten. Usage example:
+	```
+	telemetry = stage.start_telemetry(interval=1, capacity=24*60*60) # Last 24 hours.
+	... # Overnight scan.
+	records = telemetry.snapshot()
+	print(records['time'], records['CurT']/10) # Temperature in °C.
+	```
+	Each record has the fields `'time'` (from `time.monotonic()`), 
+	`'position'` (m), `'speed'` (m/s) and all the fields of 
+	`pyximc.status_t` in the units of the controller, e.g. `'CurT'` 
+	(tenths of °C), `'Upwr'` (tens of mV), `'Ipwr'` (mA).
+	"""
+	def __init__(self, stage, interval: float=1, capacity: int=3600):
+		"""Create an instance of `TelemetryRecorder`.
+		
+		Parameters
+		----------
+		stage: Stage
+			The stage to monitor.
+		interval: float, default 1
+			Time between records, in seconds.
+		capacity: int, default 3600
+			Number of records kept in memory.
+		"""
+		super().__init__(stage, interval)
+		if not (isinstance(capacity, int) and capacity > 0):
+			raise ValueError(f'`capacity` must be a positive integer, received {repr(capacity)}.')
+		self._status_fields = [name for name,_ in pyximc.status_t._fields_]
+		self.dtype = np.dtype([('time',float), ('position',float), ('speed',float)] + [(name, np.dtype(ctype)) for name,ctype in pyximc.status_t._fields_])
+		self._buffer = np.zeros(capacity, dtype=self.dtype)
+		self._total_records = 0
+		self._lock = threading.Lock()
+	
+	def _store(self, timestamp, status):
+		record = (
+			timestamp,
+			self.stage.calibration.steps2m(status.CurPosition, status.uCurPosition),
+			self.stage.calibration.steps2m(status.CurSpeed, status.uCurSpeed),
+			*[getattr(status, name) for name in self._status_fields],
+		)
+		with self._lock:
+			self._buffer[self._total_records % len(self._buffer)] = record
+			self._total_records += 1
+	
+	@property
+	def capacity(self):
+		return len(self._buffer)
+	
+	@property
+	def total_records(self):
+		"""Number of records since it was started, including those that
+		were already overwritten."""
+		return self._total_records
+	
+	def __len__(self):
+		return min(self._total_records, len(self._buffer))
+	
+	def snapshot(self):
+		"""Return a copy of the records that are in the buffer, as a NumPy
+		structured array sorted from the oldest to the newest."""
+		with self._lock:
+			if self._total_records <= len(self._buffer):
+				return self._buffer[:self._total_records].copy()
+			oldest = self._total_records % len(self._buffer)
+			return np.concatenate((self._buffer[oldest:], self._buffer[:oldest]))
+	
+	@property
+	def latest(self):
+		"""The newest record, or `None` if there is nothing yet."""
+		with self._lock:
+			if self._total_records == 0:
+				return None
+			return self._buffer[(self._total_records-1) % len(self._buffer)].copy()
+	
+	def __iter__(self):
+		"""Iterate over the records of a `snapshot`, from the oldest to
+		the newest."""
+		return iter(self.snapshot())
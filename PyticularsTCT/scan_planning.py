@@ -0,0 +1,529 @@
+import time
+import numpy as np
+
+def serpentine_grid(*axes, serpentine: bool=True):
+	"""Build the list of points of a grid scan.
+	
+	Parameters
+	----------
+	*axes: array like of float
+		The values for each axis of the grid, e.g. `serpentine_grid(xs, ys)`.
+		The first axis is the outermost (slowest) one and the last axis
+		is the innermost (fastest) one, just like in nested loops
+		```
+		for x in xs:
+			for y in ys:
+				...
+		```
+	serpentine: bool, default True
+		If `True` the direction of the inner axes is reversed after each
+		step of the outer ones (i.e. a boustrophedon ordering), so the
+		stages never have to fly back to the beginning of a row. If
+		`False` the usual row-major ordering of nested loops is produced.
+	
+	Returns
+	-------
+	points: numpy array
+		Array of shape `(number_of_points, len(axes))` with the
+		coordinates of each point in the order they have to be visited.
+	"""
+	if len(axes) == 0:
+		raise ValueError(f'At least one axis has to be given.')
+	axes = [np.atleast_1d(np.asarray(axis, dtype=float)) for axis in axes]
+	if any(axis.ndim != 1 for axis in axes):
+		raise ValueError(f'Each axis must be a one dimensional array of values.')
+	if any(len(axis) == 0 for axis in axes):
+		raise ValueError(f'Each axis must have at least one value, but axes {[i for i,axis in enumerate(axes) if len(axis) == 0]} are empty.')
+	inner = axes[-1].reshape(-1,1)
+	for axis in reversed(axes[:-1]):
+		blocks = []
+		for i,value in enumerate(axis):
+			block = inner[::-1] if serpentine and i%2==1 else inner
+			blocks.append(np.column_stack([np.full(len(block), value), block]))
+		inner = np.concatenate(blocks)
+	return inner
+
+def max_axis_move_time(speeds, overhead: float=0):
+	"""Create a simple time model for the movement of the stages in
+	which each axis moves at constant speed and all the axes move at the
+	same time, so the time to go from one point to another is the time
+	of the slowest axis (i.e. the Chebyshev distance weighted by the 
+	speeds).
+	
+	Parameters
+	----------
+	speeds: array like of float
+		Speed of each axis, e.g. in m/s.
+	overhead: float, default 0
+		A constant time added to every movement, e.g. in seconds.
+	
+	Returns
+	-------
+	move_time: callable
+		A function `move_time(a, b)` that receives two arrays of shape
+		`(..., n_axes)` with the start and end points and returns an
+		array of shape `(...)` with the time of each movement.
+	"""
+	speeds = np.asarray(speeds, dtype=float)
+	if np.any(speeds <= 0):
+		raise ValueError(f'`speeds` must be positive, received {speeds}.')
+	def move_time(a, b):
+		t = np.max(np.abs(np.asarray(b, dtype=float)-np.asarray(a, dtype=float))/speeds, axis=-1)
+		return np.where(t > 0, t + overhead, 0)
+	return move_time
+
+def _edge_costs(move_time, a, b):
+	# Wrapper of `move_time` in which the "free" endpoints of the path, represented by points with NaN coordinates, can be reached at no cost.
+	valid = ~(np.isnan(a).any(axis=-1) | np.isnan(b).any(axis=-1))
+	return np.where(valid, move_time(np.where(np.isnan(a), 0, a), np.where(np.isnan(b), 0, b)), 0)
+
+def _nearest_neighbour_order(points, move_time, start):
+	# Greedy nearest neighbour ordering. Points are sorted into a grid of cells such that each step only has to look at the points in the nearby cells, which makes this usable for ~1e5 points. This assumes that `move_time` is a "max over the axes" of a non decreasing function of the displacement in each axis, which is the case for stages that move all the axes at the same time.
+	n_points, n_axes = points.shape
+	if n_points < 3: # Nothing to optimize, and `min`/`max` below would fail for no points.
+		return np.arange(n_points)
+	lower = points.min(axis=0)
+	extent = points.max(axis=0) - lower
+	active = extent > 0
+	if not active.any():
+		return np.arange(n_points)
+	cell_size = (np.prod(extent[active])/max(1, n_points//2))**(1/active.sum())
+	cells_per_axis = np.where(active, np.maximum(1, np.ceil(extent/cell_size)), 1).astype(int)
+	cell_size = np.where(active, extent/cells_per_axis, 1)
+	cell_of_point = np.minimum(((points-lower)/cell_size).astype(int), cells_per_axis-1)
+	strides = np.cumprod(np.concatenate([[1], cells_per_axis[:-1]+2])) # The +2 avoids neighbouring cells of the borders to wrap around into other valid cells.
+	cell_id = (cell_of_point+1) @ strides
+	cells = {}
+	for idx, c in enumerate(cell_id.tolist()):
+		cells.setdefault(c, []).append(idx)
+	
+	rings = [] # `rings[r]` has the cell id offsets of the cells at a (Chebyshev) distance `r` from the current cell.
+	def ring(r):
+		while len(rings) <= r:
+			k = len(rings)
+			offsets = np.stack(np.meshgrid(*[np.arange(-k,k+1) if a else np.array([0]) for a in active], indexing='ij'), axis=-1).reshape(-1,n_axes)
+			offsets = offsets[np.abs(offsets).max(axis=1)==k]
+			rings.append((offsets @ strides).tolist())
+		return rings[r]
+	lower_bounds = [] # `lower_bounds[r]` is the minimum cost to reach any point beyond ring `r`.
+	def lower_bound(r):
+		while len(lower_bounds) <= r:
+			k = len(lower_bounds)
+			displacements = np.diag(k*cell_size)[active]
+			lower_bounds.append(float(np.min(move_time(np.zeros_like(displacements), displacements))))
+		return lower_bounds[r]
+	max_ring = int(cells_per_axis.max())
+	
+	remaining = np.ones(n_points, dtype=bool)
+	order = np.empty(n_points, dtype=int)
+	if start is None:
+		current = int(np.lexsort(points.T[::-1])[0]) # Start from one corner.
+	else:
+		current = int(np.argmin(move_time(start, points)))
+	for step in range(n_points):
+		order[step] = current
+		remaining[current] = False
+		cells[int(cell_id[current])].remove(current)
+		if step == n_points-1:
+			break
+		here = int(cell_id[current])
+		candidates = []
+		best = None
+		for r in range(max_ring+1):
+			if len(ring(r)) > n_points-step: # Searching the cells is more expensive than looking at all the remaining points.
+				candidates = np.flatnonzero(remaining)
+				best = None
+				break
+			for offset in ring(r):
+				candidates += cells.get(here+offset, [])
+			if len(candidates) > 0:
+				costs = move_time(points[current], points[candidates])
+				best = int(np.argmin(costs))
+				if costs[best] <= lower_bound(r):
+					break
+		else:
+			candidates = np.flatnonzero(remaining)
+			best = None
+		if best is None:
+			costs = move_time(points[current], points[candidates])
+			best = int(np.argmin(costs))
+		current = int(candidates[best])
+	return order
+
+def _best_moves(gains, intervals):
+	# Given arrays with the gain of each candidate move and the interval of positions in the path it modifies, returns the indices of a set of non overlapping moves with positive gain, chosen greedily by gain.
+	candidates = np.flatnonzero(gains > 1e-12*max(1, gains.max(initial=0)))
+	if len(candidates) == 0:
+		return []
+	candidates = candidates[np.argsort(-gains[candidates])]
+	_, first_occurrence = np.unique(intervals[candidates,0], return_index=True) # Keep only the best move starting at each position, the others overlap with it anyway.
+	candidates = candidates[np.sort(first_occurrence)]
+	occupied = bytearray(int(intervals.max())+2)
+	chosen = []
+	for k, (a, b) in zip(candidates.tolist(), intervals[candidates].tolist()):
+		if occupied.find(1, a, b+1) == -1:
+			occupied[a:b+1] = bytes([1])*(b+1-a)
+			chosen.append(k)
+	return chosen
+
+def _two_opt_pass(path, nodes, move_time, window):
+	# One pass of windowed 2-opt. Reversing the segment `path[i+1:j+1]` is evaluated for all `i` at once for each `j-i` up to `window`.
+	P = nodes[path]
+	m = len(path)
+	edges = _edge_costs(move_time, P[:-1], P[1:])
+	all_gains, all_intervals = [], []
+	for g in range(2, min(window, m-2)+1):
+		i = np.arange(0, m-1-g)
+		j = i + g
+		gain = edges[i] + edges[j] - _edge_costs(move_time, P[i], P[j]) - _edge_costs(move_time, P[i+1], P[j+1])
+		improves = gain > 0
+		all_gains.append(gain[improves])
+		all_intervals.append(np.column_stack([i[improves], j[improves]+1]))
+	if len(all_gains) == 0:
+		return path, 0
+	gains = np.concatenate(all_gains)
+	intervals = np.concatenate(all_intervals)
+	chosen = _best_moves(gains, intervals)
+	path = path.copy()
+	for k in chosen:
+		i, j_plus_1 = intervals[k]
+		path[i+1:j_plus_1] = path[i+1:j_plus_1][::-1]
+	return path, gains[chosen].sum()
+
+def _or_opt_pass(path, nodes, move_time, window, max_segment_length=3):
+	# One pass of windowed Or-opt. Segments of up to `max_segment_length` points are moved (possibly reversed) up to `window` positions forward or backward in the path.
+	P = nodes[path]
+	m = len(path)
+	edges = _edge_costs(move_time, P[:-1], P[1:])
+	all_gains, all_moves = [], []
+	for L in range(1, max_segment_length+1):
+		i = np.arange(1, m-L) # The segment is `path[i:i+L]`, the endpoints of the path are never moved.
+		if len(i) == 0:
+			continue
+		removal_gain = edges[i-1] + edges[i+L-1] - _edge_costs(move_time, P[i-1], P[i+L])
+		for g in range(1, window+1):
+			for direction in [1,-1]:
+				j = i+L-1+g if direction == 1 else i-1-g # Insert between `path[j]` and `path[j+1]`.
+				ok = (j >= 0) & (j <= m-2)
+				if not ok.any():
+					continue
+				ii, jj, rg = i[ok], j[ok], removal_gain[ok]
+				for reverse in [False, True]:
+					first, last = (ii+L-1, ii) if reverse else (ii, ii+L-1)
+					gain = rg + edges[jj] - _edge_costs(move_time, P[jj], P[first]) - _edge_costs(move_time, P[last], P[jj+1])
+					improves = gain > 0
+					all_gains.append(gain[improves])
+					all_moves.append(np.column_stack([ii[improves], jj[improves], np.full(improves.sum(), L), np.full(improves.sum(), reverse)]))
+	if len(all_gains) == 0:
+		return path, 0
+	gains = np.concatenate(all_gains)
+	moves = np.concatenate(all_moves).astype(int)
+	intervals = np.column_stack([np.minimum(moves[:,0]-1, moves[:,1]), np.maximum(moves[:,0]+moves[:,2], moves[:,1]+1)])
+	chosen = _best_moves(gains, intervals)
+	path = path.copy()
+	for k in chosen:
+		i, j, L, reverse = moves[k]
+		segment = path[i:i+L][::-1] if reverse else path[i:i+L]
+		if j > i:
+			path[i:j+1] = np.concatenate([path[i+L:j+1], segment])
+		else:
+			path[j+1:i+L] = np.concatenate([segment, path[j+1:i]])
+	return path, gains[chosen].sum()
+
+def optimize_scan_order(points, move_time, start=None, window: int=20, time_limit: float=10):
+	"""Find an order to visit a list of points that minimizes the total
+	travel time of the stages. An initial order is produced by the 
+	nearest neighbour heuristic and is then refined using 2-opt and Or-opt
+	moves until no more improvement is found or `time_limit` is reached.
+	
+	Parameters
+	----------
+	points: array like of shape (n_points, n_axes)
+		The points to visit.
+	move_time: callable
+		A function `move_time(a, b)` that receives two arrays of shape
+		`(..., n_axes)` and returns the time to go from each point in `a`
+		to each point in `b`, see e.g. `max_axis_move_time`. It must be
+		vectorized, symmetric and, since all the axes move at the same 
+		time, the time of a move is expected to be that of the slowest
+		axis.
+	start: array like of shape (n_axes,), optional
+		Point where the stages are before starting the scan. If `None`
+		the scan can start at any point.
+	window: int, default 20
+		The refinements only consider moves between points that are at
+		most `window` positions away from each other in the current 
+		order. Bigger values may find better solutions but take longer.
+	time_limit: float, default 10
+		Maximum time in seconds to spend refining the order.
+	
+	Returns
+	-------
+	ordered_points: numpy array
+		Array of shape `(n_points, n_axes)` with the points in the 
+		optimized order.
+	predicted_time: float
+		Total time to visit all the points, starting from `start` if it
+		was given, according to `move_time`.
+	order: numpy array of int
+		Indices such that `ordered_points = points[order]`.
+	"""
+	points = np.asarray(points, dtype=float)
+	if points.ndim != 2:
+		raise ValueError(f'`points` must be an array of shape (n_points, n_axes), received array of shape {points.shape}.')
+	if np.isnan(points).any():
+		raise ValueError(f'`points` must not contain NaN values.')
+	n_points, n_axes = points.shape
+	if start is not None:
+		start = np.asarray(start, dtype=float)
+		if start.shape != (n_axes,):
+			raise ValueError(f'`start` must have shape ({n_axes},), received {start.shape}.')
+	time_started = time.monotonic()
+	order = _nearest_neighbour_order(points, move_time, start)
+	# The path is represented including its two endpoints: the starting point (or a NaN "free" point if there is no start) and a NaN "free" end point, which can be reached from anywhere at no cost. These two never move.
+	nodes = np.concatenate([np.full((1,n_axes), np.nan) if start is None else start.reshape(1,n_axes), points, np.full((1,n_axes), np.nan)])
+	path = np.concatenate([[0], order+1, [n_points+1]])
+	while time.monotonic()-time_started < time_limit:
+		path, gain_2_opt = _two_opt_pass(path, nodes, move_time, window)
+		if time.monotonic()-time_started >= time_limit:
+			break
+		path, gain_or_opt = _or_opt_pass(path, nodes, move_time, max(1, window//2))
+		if gain_2_opt + gain_or_opt <= 0:
+			break
+	P = nodes[path]
+	predicted_time = float(_edge_costs(move_time, P[:-1], P[1:]).sum())
+	order = path[1:-1] - 1
+	return points[order], predicted_time, order
+
+def approach_plan(plan, approach: str='fast', overshoot=10e-6, direction=1, start=None, move_time=None):
+	"""Prepare a plan such that each point is approached from a given
+	side, in order to get rid of the backlash (play) of the stages, and
+	report the cost of this.
+	
+	Parameters
+	----------
+	plan: array like of shape (n_points, n_axes)
+		The points to measure, in the order they are visited.
+	approach: str, default 'fast'
+		Either `'fast'` or `'consistent'`. In the `'fast'` mode the 
+		points are visited as they are, so the side from which each 
+		coordinate is approached depends on the previous point, and 
+		each approach from the wrong side is counted in `reversals`
+		(this is where the controller does its antiplay movements, if
+		enabled). In the `'consistent'` mode a waypoint is inserted 
+		before each point that would be approached from the wrong side,
+		`overshoot` before it, so every coordinate of every point is 
+		always reached moving in `direction`.
+	overshoot: float or array like of float, default 10e-6
+		Distance of the waypoints to the points, for each axis.
+	direction: int or array like of int, default 1
+		Either `1` or `-1` for each axis, the direction in which each 
+		coordinate has to be moving when it arrives to a point.
+	start: array like of shape (n_axes,), optional
+		Where the stages are before the first point. If `None` the first
+		point is always approached through a waypoint.
+	move_time: callable, optional
+		A time model as in `optimize_scan_order`, e.g. a `MoveTimeModel`.
+		If given, the extra time is estimated.
+	
+	Returns
+	-------
+	approach_plan: dict
+		A dictionary of the form
+		```
+		{
+			'points': numpy array of shape (n_moves, n_axes), # Points and waypoints in the order to visit them.
+			'is_measurement': numpy array of bool of shape (n_moves,), # `False` for the waypoints.
+			'overhead': {
+				'reversals': int, # Number of coordinates approached from the wrong side.
+				'extra_moves': int,
+				'extra_distance': float, # Summed over the axes.
+				'extra_time': float, # `None` if no `move_time` was given.
+			},
+		}
+		```
+	"""
+	if approach not in {'fast','consistent'}:
+		raise ValueError(f'`approach` must be either "fast" or "consistent", received {repr(approach)}.')
+	plan = np.asarray(plan, dtype=float)
+	if plan.ndim != 2:
+		raise ValueError(f'`plan` must be an array of shape (n_points, n_axes), received array of shape {plan.shape}.')
+	n_points, n_axes = plan.shape
+	direction = np.broadcast_to(np.asarray(direction), (n_axes,))
+	if not np.all(np.abs(direction) == 1):
+		raise ValueError(f'`direction` must be either 1 or -1 for each axis, received {direction}.')
+	overshoot = np.broadcast_to(np.asarray(overshoot, dtype=float), (n_axes,))
+	if np.any(overshoot < 0):
+		raise ValueError(f'`overshoot` must be non negative, received {overshoot}.')
+	
+	previous = np.concatenate([np.full((1,n_axes), np.nan) if start is None else np.asarray(start, dtype=float).reshape(1,n_axes), plan[:-1]])
+	displacement = plan - previous
+	wrong_side = np.isnan(displacement) | (displacement*direction < 0) # Unknown previous position counts as wrong side.
+	
+	if approach == 'fast':
+		points = plan
+		is_measurement = np.ones(n_points, dtype=bool)
+		reversals = int(wrong_side.sum())
+	else:
+		needs_waypoint = wrong_side.any(axis=1)
+		waypoints = plan - wrong_side*direction*overshoot
+		points = np.empty((n_points+needs_waypoint.sum(), n_axes))
+		is_measurement = np.ones(len(points), dtype=bool)
+		index_of_point = np.arange(n_points) + np.cumsum(needs_waypoint) # Each point is shifted by the number of waypoints before it.
+		points[index_of_point] = plan
+		points[index_of_point[needs_waypoint]-1] = waypoints[needs_waypoint]
+		is_measurement[index_of_point[needs_waypoint]-1] = False
+		reversals = 0
+	
+	def path_distance(path):
+		full = path if start is None else np.concatenate([np.asarray(start, dtype=float).reshape(1,n_axes), path])
+		return float(np.abs(np.diff(full, axis=0)).sum())
+	def path_time(path):
+		full = path if start is None else np.concatenate([np.asarray(start, dtype=float).reshape(1,n_axes), path])
+		return float(np.sum(move_time(full[:-1], full[1:])))
+	return {
+		'points': points,
+		'is_measurement': is_measurement,
+		'overhead': {
+			'reversals': reversals,
+			'extra_moves': len(points) - n_points,
+			'extra_distance': path_distance(points) - path_distance(plan),
+			'extra_time': None if move_time is None else path_time(points) - path_time(plan),
+		},
+	}
+
+class MoveTimeModel:
+	"""Model of the time it takes the stages to move from one point to 
+	another. Each axis follows a trapezoidal speed profile (accelerate,
+	move at constant speed, decelerate) and all the axes move at the same
+	time, so the time of a movement is that of the slowest axis. The
+	model can be refined with measured durations of real movements, see
+	`record`.
+	
+	An instance can be used as the `move_time` argument of 
+	`optimize_scan_order`, i.e. `model(a, b)` is `model.estimate_move_time(a, b)`.
+	"""
+	def __init__(self, speed, acceleration, deceleration=None, overhead: float=0, max_records: int=1000):
+		"""Create an instance of `MoveTimeModel`.
+		
+		Parameters
+		----------
+		speed: array like of float
+			Maximum speed of each axis, in m/s.
+		acceleration: array like of float
+			Acceleration of each axis, in m/s^2.
+		deceleration: array like of float, optional
+			Deceleration of each axis, in m/s^2. If `None` it is the same
+			as `acceleration`.
+		overhead: float, default 0
+			Time in seconds added to each movement, e.g. for the 
+			communication with the controllers.
+		max_records: int, default 1000
+			Maximum number of measured movements to keep for `refine`.
+		"""
+		self.speed = np.asarray(speed, dtype=float)
+		self.acceleration = np.asarray(acceleration, dtype=float)
+		self.deceleration = self.acceleration if deceleration is None else np.asarray(deceleration, dtype=float)
+		if not self.speed.shape == self.acceleration.shape == self.deceleration.shape or self.speed.ndim != 1:
+			raise ValueError(f'`speed`, `acceleration` and `deceleration` must be one dimensional arrays with the same length.')
+		if any(np.any(x <= 0) for x in [self.speed, self.acceleration, self.deceleration]):
+			raise ValueError(f'`speed`, `acceleration` and `deceleration` must be positive.')
+		self.overhead = float(overhead)
+		self.time_scale = 1. # Correction factor fitted by `refine`.
+		self.max_records = max_records
+		self._records = np.empty((0,2)) # Each row is `(kinematic_time, measured_time)`.
+	
+	@classmethod
+	def from_stages(cls, stages, **kwargs):
+		"""Create a model using the speed, acceleration and deceleration
+		currently configured in each of the stages.
+		
+		Parameters
+		----------
+		stages: TCTStages or list of Stage
+			The stages.
+		**kwargs:
+			Passed to `MoveTimeModel.__init__`.
+		"""
+		profiles = [stage.motion_profile for stage in getattr(stages, '_stages', stages)]
+		return cls(
+			speed = [p['speed'] for p in profiles],
+			acceleration = [p['acceleration'] for p in profiles],
+			deceleration = [p['deceleration'] for p in profiles],
+			**kwargs,
+		)
+	
+	def axes_times(self, distance):
+		"""Return the time each axis needs to travel `distance`, an array
+		of shape `(..., n_axes)` in meters, ignoring the overhead."""
+		d = np.abs(np.asarray(distance, dtype=float))
+		v, a, dc = self.speed, self.acceleration, self.deceleration
+		ramps_distance = v**2/2/a + v**2/2/dc
+		trapezoid = v/a + v/dc + (d-ramps_distance)/v
+		peak_speed = np.sqrt(2*d*a*dc/(a+dc)) # When it never reaches `speed`, i.e. a triangular profile.
+		triangle = peak_speed/a + peak_speed/dc
+		return np.where(d >= ramps_distance, trapezoid, triangle)
+	
+	def _kinematic_time(self, start, end):
+		return np.max(self.axes_times(np.asarray(end, dtype=float)-np.asarray(start, dtype=float)), axis=-1)
+	
+	def estimate_move_time(self, start, end):
+		"""Estimate the time to move from `start` to `end`.
+		
+		Parameters
+		----------
+		start, end: array like of shape (..., n_axes)
+			Initial and final points, in meters. Many movements can be
+			estimated at once.
+		
+		Returns
+		-------
+		time: float or numpy array
+			Time in seconds of each movement. Movements with zero distance
+			take no time.
+		"""
+		t = self._kinematic_time(start, end)
+		return np.where(t > 0, self.time_scale*t + self.overhead, 0)
+	
+	__call__ = estimate_move_time
+	
+	def estimate_plan_time(self, plan, start=None):
+		"""Estimate the time to go through all the points in `plan`.
+		
+		Parameters
+		----------
+		plan: array like of shape (n_points, n_axes)
+			The points in the order they are visited.
+		start: array like of shape (n_axes,), optional
+			Where the stages are before starting. If `None`, the plan is
+			assumed to start at its first point.
+		
+		Returns
+		-------
+		time: float
+			Total time in seconds.
+		"""
+		plan = np.asarray(plan, dtype=float)
+		if start is not None:
+			plan = np.concatenate([np.asarray(start, dtype=float).reshape(1,-1), plan])
+		return float(np.sum(self.estimate_move_time(plan[:-1], plan[1:])))
+	
+	def record(self, start, end, duration: float):
+		"""Record the measured duration of a movement from `start` to `end`
+		and refine the model with it, see `refine`."""
+		kinematic_time = float(self._kinematic_time(start, end))
+		if kinematic_time <= 0:
+			return
+		self._records = np.concatenate([self._records, [[kinematic_time, duration]]])[-self.max_records:]
+		self.refine()
+	
+	def refine(self):
+		"""Fit `time_scale` and `overhead` to the recorded movements, such
+		that `measured_time = time_scale*kinematic_time + overhead`. 
+		Nothing is done until there are enough measurements of different
+		movements."""
+		if len(self._records) < 5 or np.ptp(self._records[:,0]) <= 0:
+			return
+		(time_scale, overhead), *_ = np.linalg.lstsq(np.column_stack([self._records[:,0], np.ones(len(self._records))]), self._records[:,1], rcond=None)
+		if time_scale > 0: # Otherwise the data makes no sense, e.g. too few or too noisy.
+			self.time_scale, self.overhead = float(time_scale), float(max(0, overhead))
@@ -0,0 +1,415 @@
+"""A local server that owns the stages and the laser, so several
+processes (scans, GUIs, analysis scripts) can use the same TCT at the
+same time. Start it with
+```
+python -m PyticularsTCT.server --x-stage-port /dev/ttyACM0 --y-stage-port /dev/ttyACM1 --z-stage-port /dev/ttyACM2
+```
+and then, from as many processes as you want,
+```
+from PyticularsTCT.server import TCTClient
+tct = TCTClient()
+tct.stages.move_to(x=1e-3)
+tct.laser.set(frequency=1e3, DAC=0, status='on')
+```
+The communication is through a Unix socket using a small binary
+protocol: each message is a `uint16` with the length followed by an
+opcode byte and the arguments packed with `struct`.
+"""
+
+import socket
+import socketserver
+import struct
+import threading
+import time
+import ctypes
+import math
+import argparse
+from pathlib import Path
+from .stage import TCTStages, TEMPORARY_FILES_PATH
+from .ximc import pyximc
+
+DEFAULT_SOCKET_PATH = TEMPORARY_FILES_PATH/Path('server.sock')
+
+# Opcodes ---
+_PING = 0
+_MOVE_TO = 1 # Arguments `<?3d`: concurrent, x, y, z (NaN means `None`).
+_MOVE_REL = 2 # Same as `_MOVE_TO`.
+_POSITION = 3 # Returns `<3d`.
+_COMMANDED_POSITION = 4 # Returns `<3d`.
+_STAGE_STATUS = 5 # Arguments `<Bd`: stage index, maximum age of the cached status. Returns `<dd?I`, see `Stage.get_status(format='tuple')`.
+_RESET_POSITION = 6
+_LASER_SET = 7 # Arguments `<BdHB`: which of the following are given (1 frequency, 2 DAC, 4 status), frequency, DAC, status (1 on, 0 off).
+_LASER_STATE = 8 # Arguments `<d`: maximum age of the cached status. Returns `<?dH`: is on, frequency, DAC.
+
+_OK = 0
+_ERROR = 1 # Followed by the name of the exception type and the message, separated by `\0`.
+
+_LENGTH = struct.Struct('<H')
+_MOVE = struct.Struct('<?3d')
+_XYZ = struct.Struct('<3d')
+_STAGE_STATUS_REQUEST = struct.Struct('<Bd')
+_STAGE_STATUS_RESPONSE = struct.Struct('<dd?I')
+_LASER_SET_REQUEST = struct.Struct('<BdHB')
+_MAX_AGE = struct.Struct('<d')
+_LASER_STATE_RESPONSE = struct.Struct('<?dH')
+
+_EXCEPTIONS = {e.__name__: e for e in [ValueError, TypeError, RuntimeError, TimeoutError]} # Exceptions that are re-raised as they are in the client, any other becomes a `RuntimeError`.
+
+def _receive_exactly(sock, n_bytes: int):
+	data = b''
+	while len(data) < n_bytes:
+		chunk = sock.recv(n_bytes-len(data))
+		if not chunk:
+			raise ConnectionError('Connection closed.')
+		data += chunk
+	return data
+
+def _send_message(sock, payload: bytes):
+	sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+def _receive_message(sock):
+	length, = _LENGTH.unpack(_receive_exactly(sock, _LENGTH.size))
+	return _receive_exactly(sock, length)
+
+def _nan_to_none(values):
+	return [None if math.isnan(v) else v for v in values]
+
+def _none_to_nan(values):
+	return [math.nan if v is None else v for v in values]
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+	def handle(self):
+		while True:
+			try:
+				request = _receive_message(self.request)
+			except ConnectionError:
+				return
+			try:
+				response = bytes([_OK]) + self.server._execute(request[0], request[1:])
+			except Exception as e:
+				response = bytes([_ERROR]) + f'{type(e).__name__}\0{e}'.encode('utf8', errors='replace')[:60000]
+			_send_message(self.request, response)
+
+class TCTServer(socketserver.ThreadingUnixStreamServer):
+	"""Serves the stages and the laser to `TCTClient`s. Commands to each
+	device are executed one after the other, while different devices
+	work at the same time. Status queries are answered from a cache so
+	they don't wait for a movement to finish."""
+	daemon_threads = True
+	
+	def __init__(self, stages: TCTStages=None, laser=None, socket_path=DEFAULT_SOCKET_PATH):
+		"""Create an instance of `TCTServer`, call `serve_forever` to
+		start serving.
+		
+		Parameters
+		----------
+		stages: TCTStages, optional
+			The stages to serve.
+		laser: ParticularsLaserController, optional
+			The laser to serve.
+		socket_path: Path, default DEFAULT_SOCKET_PATH
+			Path of the Unix socket.
+		"""
+		self.stages = stages
+		self.laser = laser
+		self.socket_path = Path(socket_path)
+		self._stage_locks = [threading.Lock() for _ in range(3)]
+		self._laser_lock = threading.Lock()
+		# Status of the stages, read with their own buffers so this does not interfere with the movements ---
+		self._status_locks = [threading.Lock() for _ in range(3)]
+		self._status_buffers = [pyximc.status_t() for _ in range(3)]
+		self._status_cache = [(-math.inf, None)]*3 # `(time, status)` for each stage.
+		self._laser_cache = (-math.inf, None) # `(time, (is_on, frequency, DAC))`.
+		
+		self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+		if self.socket_path.exists():
+			try:
+				with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+					sock.connect(str(self.socket_path))
+			except (ConnectionRefusedError, FileNotFoundError):
+				self.socket_path.unlink() # Left by a server that is not running anymore.
+			else:
+				raise RuntimeError(f'There is already a server running in {self.socket_path}.')
+		super().__init__(str(self.socket_path), _RequestHandler)
+	
+	def close(self):
+		"""Stop serving (call it from a different thread than the one in
+		`serve_forever`) and remove the socket file."""
+		self.shutdown()
+		self.server_close()
+		if self.socket_path.exists():
+			self.socket_path.unlink()
+	
+	def _check_device(self, device):
+		if device is None:
+			raise RuntimeError(f'This server has no such device.')
+		return device
+	
+	def _move(self, body: bytes, relative: bool):
+		stages = self._check_device(self.stages)
+		concurrent, *xyz = _MOVE.unpack(body)
+		xyz = _nan_to_none(xyz)
+		locks = [lock for lock,coord in zip(self._stage_locks, xyz) if coord is not None] # Always in the same order, so no deadlocks. `TCTStages` only reads and updates the cache of the stages that are moved, so the others are not needed.
+		for lock in locks:
+			lock.acquire()
+		try:
+			if relative:
+				stages.move_rel(*xyz, concurrent=concurrent)
+			else:
+				stages.move_to(*xyz, concurrent=concurrent)
+		finally:
+			for lock in locks:
+				lock.release()
+	
+	def _all_stages_locked(self, function):
+		for lock in self._stage_locks:
+			lock.acquire()
+		try:
+			return function()
+		finally:
+			for lock in self._stage_locks:
+				lock.release()
+	
+	def _stage_status(self, i: int, max_age: float):
+		stages = self._check_device(self.stages)
+		if not 0 <= i < 3:
+			raise ValueError(f'Stage index must be 0, 1 or 2, received {i}.')
+		with self._status_locks[i]:
+			timestamp, status = self._status_cache[i]
+			if status is None or time.monotonic() - timestamp > max_age: # Never read yet, or too old.
+				stage = stages._stages[i]
+				buffer = self._status_buffers[i]
+				stage._lib.get_status(stage._dev_id, ctypes.byref(buffer))
+				status = (
+					stage.calibration.steps2m(buffer.CurPosition, buffer.uCurPosition),
+					stage.calibration.steps2m(buffer.CurSpeed, buffer.uCurSpeed),
+					bool(buffer.MoveSts & pyximc.MoveState.MOVE_STATE_MOVING),
+					buffer.CmdBufFreeSpace,
+				)
+				self._status_cache[i] = (time.monotonic(), status)
+		return status
+	
+	def _laser_state(self, max_age: float):
+		laser = self._check_device(self.laser)
+		with self._laser_lock:
+			timestamp, state = self._laser_cache
+			if state is None or time.monotonic() - timestamp > max_age: # Never read yet, or too old.
+				state = (laser.status == 'on', laser.frequency, laser.DAC)
+				self._laser_cache = (time.monotonic(), state)
+		return state
+	
+	def _laser_set(self, body: bytes):
+		laser = self._check_device(self.laser)
+		given, frequency, DAC, status = _LASER_SET_REQUEST.unpack(body)
+		with self._laser_lock:
+			laser.set(
+				frequency = frequency if given & 1 else None,
+				DAC = DAC if given & 2 else None,
+				status = ('on' if status else 'off') if given & 4 else None,
+			)
+			timestamp, state = self._laser_cache
+			if given & 4:
+				self._laser_cache = (time.monotonic(), (bool(status), laser.frequency, laser.DAC))
+			elif state is not None: # The status did not change.
+				self._laser_cache = (timestamp, (state[0], laser.frequency, laser.DAC))
+	
+	def _execute(self, opcode: int, body: bytes):
+		"""Execute one request and return the packed response."""
+		if opcode == _PING:
+			return b''
+		elif opcode == _MOVE_TO:
+			self._move(body, relative=False)
+			return b''
+		elif opcode == _MOVE_REL:
+			self._move(body, relative=True)
+			return b''
+		elif opcode == _POSITION:
+			self._check_device(self.stages)
+			return _XYZ.pack(*[self._stage_status(i, max_age=0)[0] for i in range(3)])
+		elif opcode == _COMMANDED_POSITION:
+			stages = self._check_device(self.stages)
+			position = [stages._cached_coordinate(i) for i in range(3)]
+			if any(pos is None for pos in position):
+				position = self._all_stages_locked(lambda: stages.commanded_position)
+			return _XYZ.pack(*position)
+		elif opcode == _STAGE_STATUS:
+			return _STAGE_STATUS_RESPONSE.pack(*self._stage_status(*_STAGE_STATUS_REQUEST.unpack(body)))
+		elif opcode == _RESET_POSITION:
+			stages = self._check_device(self.stages)
+			self._all_stages_locked(stages.reset_position)
+			return b''
+		elif opcode == _LASER_SET:
+			self._laser_set(body)
+			return b''
+		elif opcode == _LASER_STATE:
+			return _LASER_STATE_RESPONSE.pack(*self._laser_state(*_MAX_AGE.unpack(body)))
+		else:
+			raise ValueError(f'Unknown opcode {opcode}.')
+
+class _RemoteStages:
+	"""Same interface as `TCTStages`, but through a `TCTServer`."""
+	def __init__(self, client):
+		self._client = client
+	
+	def move_to(self, x: float=None, y: float=None, z: float=None, concurrent: bool=False):
+		"""See `TCTStages.move_to`."""
+		self._client._request(_MOVE_TO, _MOVE.pack(concurrent, *_none_to_nan([x,y,z])))
+	
+	def move_rel(self, x: float=None, y: float=None, z: float=None, concurrent: bool=True):
+		"""See `TCTStages.move_rel`."""
+		self._client._request(_MOVE_REL, _MOVE.pack(concurrent, *_none_to_nan([x,y,z])))
+	
+	@property
+	def position(self):
+		"""See `TCTStages.position`."""
+		return _XYZ.unpack(self._client._request(_POSITION))
+	
+	@property
+	def commanded_position(self):
+		"""See `TCTStages.commanded_position`."""
+		return _XYZ.unpack(self._client._request(_COMMANDED_POSITION))
+	
+	def get_status(self, coordinate: str, max_age: float=50e-3):
+		"""Returns `(position, speed, is_moving, cmd_buf_free_space)` of
+		one of the stages, see `Stage.get_status(format='tuple')`.
+		
+		Parameters
+		----------
+		coordinate: str
+			Either `'x'`, `'y'` or `'z'`.
+		max_age: float, default 50e-3
+			If the server read the status less than this number of seconds
+			ago, that value is returned without reading it again.
+		"""
+		if coordinate not in {'x','y','z'}:
+			raise ValueError(f'`coordinate` must be one of {{"x","y","z"}}, received {repr(coordinate)}.')
+		return _STAGE_STATUS_RESPONSE.unpack(self._client._request(_STAGE_STATUS, _STAGE_STATUS_REQUEST.pack(['x','y','z'].index(coordinate), max_age)))
+	
+	def reset_position(self):
+		"""See `TCTStages.reset_position`."""
+		self._client._request(_RESET_POSITION)
+
+class _RemoteLaser:
+	"""Same interface as `ParticularsLaserController`, but through a
+	`TCTServer`. Reading `status`, `frequency` or `DAC` does not
+	communicate with the laser, the server remembers them."""
+	def __init__(self, client):
+		self._client = client
+	
+	def _state(self):
+		return _LASER_STATE_RESPONSE.unpack(self._client._request(_LASER_STATE, _MAX_AGE.pack(math.inf)))
+	
+	def set(self, frequency: float=None, DAC: int=None, status: str=None):
+		"""See `ParticularsLaserController.set`."""
+		if status is not None and status not in {'on','off'}:
+			raise ValueError(f'`status` must be either "on" or "off", received {repr(status)}.')
+		given = (frequency is not None)*1 | (DAC is not None)*2 | (status is not None)*4
+		self._client._request(_LASER_SET, _LASER_SET_REQUEST.pack(given, frequency or 0, DAC or 0, status == 'on'))
+	
+	def on(self):
+		"""Turn the laser on."""
+		self.set(status='on')
+	
+	def off(self):
+		"""Turn the laser off."""
+		self.set(status='off')
+	
+	@property
+	def status(self):
+		"""Returns either 'on' or 'off'."""
+		return 'on' if self._state()[0] else 'off'
+	@status.setter
+	def status(self, status: str):
+		self.set(status=status)
+	
+	@property
+	def frequency(self):
+		"""Return the current value for the frequency."""
+		return self._state()[1]
+	@frequency.setter
+	def frequency(self, Hz: float):
+		self.set(frequency=Hz)
+	
+	@property
+	def DAC(self):
+		"""Return the current value for the DAC."""
+		return self._state()[2]
+	@DAC.setter
+	def DAC(self, DAC: int):
+		self.set(DAC=DAC)
+
+class TCTClient:
+	"""Connects to a `TCTServer`. It has `stages` and `laser` attributes
+	with the same interface as in `TCT`, so it can be used instead.
+	Connecting is fast because the devices are already open in the
+	server. An instance can be shared between threads."""
+	def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+		"""Create an instance of `TCTClient`.
+		
+		Parameters
+		----------
+		socket_path: Path, default DEFAULT_SOCKET_PATH
+			Path of the Unix socket of the server.
+		"""
+		self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			self._socket.connect(str(socket_path))
+		except (ConnectionRefusedError, FileNotFoundError):
+			self._socket.close()
+			raise RuntimeError(f'Cannot connect to a `TCTServer` in {socket_path}, is it running?')
+		self._lock = threading.Lock()
+		self.stages = _RemoteStages(self)
+		self.laser = _RemoteLaser(self)
+	
+	def _request(self, opcode: int, body: bytes=b''):
+		with self._lock:
+			_send_message(self._socket, bytes([opcode]) + body)
+			response = _receive_message(self._socket)
+		if response[0] == _ERROR:
+			exception_name, message = response[1:].decode('utf8').split('\0', 1)
+			raise _EXCEPTIONS.get(exception_name, RuntimeError)(message)
+		return response[1:]
+	
+	def ping(self):
+		"""Return the round trip time to the server, in seconds."""
+		time_started = time.monotonic()
+		self._request(_PING)
+		return time.monotonic() - time_started
+	
+	def close(self):
+		self._socket.close()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve the stages and the laser of the TCT to other processes through a Unix socket.')
+	parser.add_argument('--x-stage-port', help='Port of the x stage, e.g. /dev/ttyACM0.')
+	parser.add_argument('--y-stage-port', help='Port of the y stage.')
+	parser.add_argument('--z-stage-port', help='Port of the z stage.')
+	parser.add_argument('--no-laser', action='store_true', help='Do not open the laser.')
+	parser.add_argument('--socket', default=str(DEFAULT_SOCKET_PATH), help=f'Path of the socket, default {DEFAULT_SOCKET_PATH}.')
+	args = parser.parse_args()
+	
+	ports = [args.x_stage_port, args.y_stage_port, args.z_stage_port]
+	if any(port is None for port in ports) and any(port is not None for port in ports):
+		parser.error('either all of --x-stage-port, --y-stage-port and --z-stage-port are given, or none of them (to serve only the laser)')
+	stages = None
+	if all(port is not None for port in ports):
+		stages = TCTStages(*ports)
+	laser = None
+	if not args.no_laser:
+		from .ParticularsLaserController import ParticularsLaserController
+		laser = ParticularsLaserController()
+	server = TCTServer(stages=stages, laser=laser, socket_path=args.socket)
+	print(f'Serving in {args.socket}, press Ctrl+C to stop.')
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		Path(args.socket).unlink(missing_ok=True)
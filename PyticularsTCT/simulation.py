@@ -0,0 +1,564 @@
+import time
+import ctypes
+import threading
+import random
+from collections import deque
+from .ximc import pyximc
+
+class VirtualClock:
+	"""A clock that only advances when it is told to, so simulations are
+	deterministic and don't have to wait for anything. Call it to get
+	the current time."""
+	def __init__(self, start: float=0):
+		self._time = start
+		self._lock = threading.Lock()
+	
+	def __call__(self):
+		return self._time
+	
+	def advance(self, seconds: float):
+		"""Move the clock forward."""
+		with self._lock:
+			self._time += seconds
+	
+	def advance_to(self, t: float):
+		"""Move the clock forward up to `t`, if it is not already there."""
+		with self._lock:
+			self._time = max(self._time, t)
+
+def _copy_structure(source, destination):
+	ctypes.memmove(ctypes.addressof(destination), ctypes.addressof(source), ctypes.sizeof(source))
+
+class _Segment:
+	# A movement that ends at rest with a trapezoidal (or triangular) speed profile, in micro steps and seconds. It starts at `start_speed`, which is towards `target`.
+	def __init__(self, start_time, start_position, target, speed, acceleration, deceleration, command, set_zero=False, start_speed=0):
+		self.start_time = start_time
+		self.start_position = start_position
+		self.target = target
+		self.command = command
+		self.set_zero = set_zero # For homing, the end of this segment becomes the 0.
+		distance = abs(target-start_position)
+		self.direction = 1 if target >= start_position else -1
+		self.acceleration = acceleration
+		self.deceleration = deceleration
+		self.start_speed = start_speed = min(start_speed, (2*distance*deceleration)**.5) # It cannot be faster than what allows it to stop at `target`.
+		speed = max(speed, start_speed)
+		if distance == 0:
+			self.peak_speed, self.t_acceleration, self.t_constant, self.t_deceleration = 0, 0, 0, 0
+		elif distance >= (speed**2-start_speed**2)/2/acceleration + speed**2/2/deceleration:
+			self.peak_speed = speed
+			self.t_acceleration = (speed-start_speed)/acceleration
+			self.t_deceleration = speed/deceleration
+			self.t_constant = (distance - (speed**2-start_speed**2)/2/acceleration - speed**2/2/deceleration)/speed
+		else: # It never reaches `speed`.
+			self.peak_speed = ((2*distance*acceleration*deceleration + start_speed**2*deceleration)/(acceleration+deceleration))**.5
+			self.t_acceleration = (self.peak_speed-start_speed)/acceleration
+			self.t_deceleration = self.peak_speed/deceleration
+			self.t_constant = 0
+		self.end_time = start_time + self.t_acceleration + self.t_constant + self.t_deceleration
+	
+	def state(self, t):
+		"""Return `(position, speed, at_target_speed)` at time `t`."""
+		tau = min(max(t-self.start_time, 0), self.end_time-self.start_time)
+		a, v0, v, d = self.acceleration, self.start_speed, self.peak_speed, self.deceleration
+		if tau < self.t_acceleration:
+			traveled, speed, at_target_speed = v0*tau + a*tau**2/2, v0 + a*tau, False
+		elif tau < self.t_acceleration + self.t_constant:
+			traveled, speed, at_target_speed = (v0+v)*self.t_acceleration/2 + v*(tau-self.t_acceleration), v, True
+		else:
+			tau_deceleration = tau - self.t_acceleration - self.t_constant
+			traveled = (v0+v)*self.t_acceleration/2 + v*self.t_constant + v*tau_deceleration - d*tau_deceleration**2/2
+			speed, at_target_speed = v - d*tau_deceleration, False
+		if tau >= self.end_time-self.start_time:
+			return self.target, 0, False
+		return self.start_position + self.direction*traveled, self.direction*speed, at_target_speed
+
+class _SimulatedDevice:
+	def __init__(self, uri: bytes, serial_number: int, travel: int, microstep_mode: int):
+		self.uri = uri
+		self.serial_number = serial_number
+		self.usteps_per_step = 2**(microstep_mode-1)
+		self.travel = travel*self.usteps_per_step # Physical range of the stage is `[0, travel]`, in micro steps.
+		self.home = self.travel/2 # Where the limit switch + homing offset leaves the stage.
+		self.position = self.home # Physical position in micro steps.
+		self.zero = self.home # Physical position of the 0 of the coordinates.
+		self.current_segment = None
+		self.queue = deque()
+		self.last_command = pyximc.MvcmdStatus.MVCMD_UKNWN
+		self.move_settings = pyximc.move_settings_t(Speed=400, Accel=1000, Decel=1000, AntiplaySpeed=400)
+		self.engine_settings = pyximc.engine_settings_t(NomVoltage=1200, NomCurrent=300, NomSpeed=400, MicrostepMode=microstep_mode, StepsPerRev=200)
+		self.sync_out_settings = pyximc.sync_out_settings_t(SyncOutPulseSteps=100)
+		self.sync_in_settings = pyximc.sync_in_settings_t()
+
+class SimulatedXimc:
+	"""Simulator of the ximc library that can be used instead of
+	`pyximc.lib` as the backend of `Stage`, to run everything without
+	the physical stages. Usage example:
+	```
+	from PyticularsTCT.simulation import SimulatedXimc, VirtualClock
+	stages = TCTStages('sim/x', 'sim/y', 'sim/z', backend=SimulatedXimc(clock=VirtualClock()))
+	```
+	What is simulated:
+	- Movements follow trapezoidal speed profiles according to the
+	speed, acceleration and deceleration in `move_settings_t`.
+	- Movement commands received while moving replace the target of
+	the current movement, as the controllers do. With `queue_commands=True`
+	they go instead into a command buffer of `command_buffer_size` and
+	are executed one after the other, this is reported in
+	`status_t.CmdBufFreeSpace`.
+	- Homing (`command_homezero`) goes to the lower end of the stage,
+	then to the middle and defines the 0 there. It returns when the
+	homing is finished.
+	- The status reports position, speed, movement state, last command,
+	temperature, power supply and USB voltages and currents.
+	- Each call to the library takes `latency` seconds.
+	With `clock=VirtualClock()` no real time passes: each call advances
+	the clock by `latency` and waiting for a stop jumps to the end of the
+	movement, so everything is fast and deterministic.
+	"""
+	def __init__(self, latency: float=1e-3, clock=None, command_buffer_size: int=8, queue_commands: bool=False, travel: int=40000, microstep_mode: int=pyximc.MicrostepMode.MICROSTEP_MODE_FRAC_256):
+		"""Create an instance of `SimulatedXimc`.
+		
+		Parameters
+		----------
+		latency: float, default 1e-3
+			Time in seconds that each call to the library takes. It has to
+			be positive if `clock` is a `VirtualClock`, otherwise the time
+			would never advance while polling the status.
+		clock: callable, optional
+			Function returning the time in seconds, e.g. a `VirtualClock`.
+			By default `time.monotonic` is used, i.e. real time.
+		command_buffer_size: int, default 8
+			Number of movement commands that can wait while the stage is
+			moving, if `queue_commands` is `True`.
+		queue_commands: bool, default False
+			If `False` a movement command received while moving replaces
+			the target of the current movement. If `True` it waits in the
+			command buffer until the current movement finishes.
+		travel: int, default 40000
+			Range of each stage, in steps.
+		microstep_mode: int, default MICROSTEP_MODE_FRAC_256
+			One of `pyximc.MicrostepMode`, reported in `engine_settings_t`.
+		"""
+		if not latency >= 0:
+			raise ValueError(f'`latency` must be a non negative number of seconds, received {repr(latency)}.')
+		if isinstance(clock, VirtualClock) and latency == 0:
+			raise ValueError(f'With a `VirtualClock` the `latency` must be positive.')
+		self.latency = latency
+		self.clock = time.monotonic if clock is None else clock
+		self.command_buffer_size = command_buffer_size
+		self.queue_commands = queue_commands
+		self.travel = travel
+		self.microstep_mode = microstep_mode
+		self.devices = {}
+		self.calls_count = 0
+		self._next_id = 1
+		self._lock = threading.RLock()
+	
+	def __getattr__(self, name):
+		raise AttributeError(f'`{name}` is not simulated by `SimulatedXimc`.')
+	
+	# Internal stuff ---
+	
+	def _call(self):
+		# Emulate the time that each call takes, and return the time at which it happens.
+		self.calls_count += 1
+		if self.latency > 0:
+			if isinstance(self.clock, VirtualClock):
+				self.clock.advance(self.latency)
+			else:
+				time.sleep(self.latency)
+		return self.clock()
+	
+	def _device(self, device_id):
+		if device_id not in self.devices:
+			raise ValueError(f'There is no simulated device with id {device_id}.')
+		return self.devices[device_id]
+	
+	def _update(self, device, now):
+		# Bring the state of `device` to time `now`.
+		while device.current_segment is not None and device.current_segment.end_time <= now:
+			finished = device.current_segment
+			device.position = finished.target
+			if finished.set_zero:
+				device.zero = finished.target
+			device.current_segment = None
+			if device.queue:
+				self._start_segment(device, device.queue.popleft(), finished.end_time)
+		if device.current_segment is not None:
+			device.position = device.current_segment.state(now)[0]
+	
+	def _start_segment(self, device, command, start_time, start_speed=0):
+		physical_target, command_name, set_zero = command
+		settings = device.move_settings
+		n = device.usteps_per_step
+		device.current_segment = _Segment(
+			start_time = start_time,
+			start_position = device.position,
+			target = min(max(physical_target, 0), device.travel), # The stage cannot go beyond its ends.
+			speed = max(settings.Speed*n + settings.uSpeed, 1),
+			acceleration = max(settings.Accel*n, 1),
+			deceleration = max(settings.Decel*n, 1),
+			command = command_name,
+			set_zero = set_zero,
+			start_speed = start_speed,
+		)
+		device.last_command = command_name
+	
+	def _replace_target(self, device, commands, now):
+		# Go to the first of `commands` from the current state without stopping, if possible, and queue the rest.
+		device.queue.clear()
+		speed = 0
+		if device.current_segment is not None:
+			_, speed, _ = device.current_segment.state(now)
+			device.current_segment = None
+		target = min(max(commands[0][0], 0), device.travel)
+		deceleration = max(device.move_settings.Decel*device.usteps_per_step, 1)
+		stopping_distance = speed**2/2/deceleration
+		if speed == 0 or (target-device.position)*speed >= stopping_distance*abs(speed): # It can stop at `target` without going back.
+			self._start_segment(device, commands[0], now, start_speed=abs(speed))
+		else: # First stop, then go back.
+			self._start_segment(device, (device.position + (1 if speed > 0 else -1)*stopping_distance, commands[0][1], False), now, start_speed=abs(speed))
+			device.queue.append(commands[0])
+		device.queue.extend(commands[1:])
+	
+	def _last_target(self, device):
+		if device.queue:
+			return device.queue[-1][0]
+		if device.current_segment is not None:
+			return device.current_segment.target
+		return device.position
+	
+	def _command(self, device_id, commands):
+		# Queue a list of `(physical_target, command_name, set_zero)`.
+		now = self._call()
+		with self._lock:
+			device = self._device(device_id)
+			self._update(device, now)
+			if not self.queue_commands:
+				self._replace_target(device, commands, now)
+				return pyximc.Result.Ok
+			if len(device.queue) + len(commands) > self.command_buffer_size + (device.current_segment is None):
+				return pyximc.Result.Error # The command buffer is full.
+			for command in commands:
+				if device.current_segment is None:
+					self._start_segment(device, command, now)
+				else:
+					device.queue.append(command)
+		return pyximc.Result.Ok
+	
+	def end_of_movement(self, device_id):
+		"""Time at which the stage will stop, if no more commands arrive."""
+		with self._lock:
+			device = self._device(device_id)
+			self._update(device, self.clock())
+			if device.current_segment is None:
+				return self.clock()
+			end = device.current_segment.end_time
+			position = device.current_segment.target
+			for target, command_name, set_zero in device.queue: # These have not started yet, compute their durations.
+				settings = device.move_settings
+				n = device.usteps_per_step
+				end = _Segment(end, position, min(max(target, 0), device.travel), max(settings.Speed*n + settings.uSpeed, 1), max(settings.Accel*n, 1), max(settings.Decel*n, 1), command_name).end_time
+				position = min(max(target, 0), device.travel)
+			return end
+	
+	# The ximc API ---
+	
+	def open_device(self, uri):
+		self._call()
+		with self._lock:
+			device_id = self._next_id
+			self._next_id += 1
+			self.devices[device_id] = _SimulatedDevice(uri, serial_number=0x10000+device_id, travel=self.travel, microstep_mode=self.microstep_mode)
+		return device_id
+	
+	def close_device(self, device_id_ref):
+		self._call()
+		with self._lock:
+			self.devices.pop(device_id_ref._obj.value, None)
+		return pyximc.Result.Ok
+	
+	def command_move(self, device_id, steps, usteps):
+		device = self._device(device_id)
+		return self._command(device_id, [(device.zero + steps*device.usteps_per_step + usteps, pyximc.MvcmdStatus.MVCMD_MOVE, False)])
+	
+	def command_movr(self, device_id, steps, usteps):
+		with self._lock:
+			device = self._device(device_id)
+			self._update(device, self.clock())
+			target = self._last_target(device) + steps*device.usteps_per_step + usteps
+		return self._command(device_id, [(target, pyximc.MvcmdStatus.MVCMD_MOVR, False)])
+	
+	def command_homezero(self, device_id):
+		device = self._device(device_id)
+		result = self._command(device_id, [
+			(0, pyximc.MvcmdStatus.MVCMD_HOME, False), # Go to the limit switch.
+			(device.home, pyximc.MvcmdStatus.MVCMD_HOME, True), # Go to the home position and define the 0 there.
+		])
+		if result != pyximc.Result.Ok:
+			return result
+		return self.command_wait_for_stop(device_id, 10) # Like the library, it returns once the homing is finished.
+	
+	def command_stop(self, device_id):
+		now = self._call()
+		with self._lock:
+			device = self._device(device_id)
+			self._update(device, now)
+			device.queue.clear()
+			device.current_segment = None
+			device.last_command = pyximc.MvcmdStatus.MVCMD_STOP
+		return pyximc.Result.Ok
+	
+	def command_sstp(self, device_id):
+		now = self._call()
+		with self._lock:
+			device = self._device(device_id)
+			self._update(device, now)
+			device.queue.clear()
+			if device.current_segment is not None: # Decelerate until it stops.
+				_, speed, _ = device.current_segment.state(now)
+				stopping_distance = speed**2/2/max(device.move_settings.Decel*device.usteps_per_step, 1)
+				self._start_segment(device, (device.position + (1 if speed > 0 else -1)*stopping_distance, pyximc.MvcmdStatus.MVCMD_SSTP, False), now, start_speed=abs(speed))
+			device.last_command = pyximc.MvcmdStatus.MVCMD_SSTP
+		return pyximc.Result.Ok
+	
+	def command_wait_for_stop(self, device_id, refresh_interval_ms):
+		self._call()
+		while True:
+			end = self.end_of_movement(device_id)
+			if isinstance(self.clock, VirtualClock):
+				self.clock.advance_to(end)
+			if self.clock() >= end:
+				return pyximc.Result.Ok
+			time.sleep(min(max(refresh_interval_ms, 1)*1e-3, end-self.clock()))
+	
+	def get_status(self, device_id, status_ref):
+		now = self._call()
+		with self._lock:
+			device = self._device(device_id)
+			self._update(device, now)
+			status = status_ref._obj
+			n = device.usteps_per_step
+			speed, at_target_speed = 0, False
+			if device.current_segment is not None:
+				_, speed, at_target_speed = device.current_segment.state(now)
+			moving = device.current_segment is not None
+			status.MoveSts = (pyximc.MoveState.MOVE_STATE_MOVING if moving else 0) | (pyximc.MoveState.MOVE_STATE_TARGET_SPEED if at_target_speed else 0)
+			status.MvCmdSts = device.last_command | (pyximc.MvcmdStatus.MVCMD_RUNNING if moving else 0)
+			status.PWRSts = 3 # PWR_STATE_NORM.
+			status.EncSts = 0
+			status.WindSts = 0
+			status.CurPosition, status.uCurPosition = divmod(round(device.position - device.zero), n)
+			status.EncPosition = round(device.position - device.zero)
+			status.CurSpeed, status.uCurSpeed = divmod(round(speed), n)
+			status.Ipwr = 300 if moving else 100 # mA.
+			status.Upwr = 1200 # Tens of mV.
+			status.Iusb = 100 # mA.
+			status.Uusb = 500 # Tens of mV.
+			status.CurT = 250 # Tenths of °C.
+			status.Flags = 0
+			status.GPIOFlags = 0
+			status.CmdBufFreeSpace = self.command_buffer_size - len(device.queue) if self.queue_commands else self.command_buffer_size
+		return pyximc.Result.Ok
+	
+	def get_position(self, device_id, position_ref):
+		now = self._call()
+		with self._lock:
+			device = self._device(device_id)
+			self._update(device, now)
+			position = position_ref._obj
+			position.Position, position.uPosition = divmod(round(device.position - device.zero), device.usteps_per_step)
+			position.EncPosition = round(device.position - device.zero)
+		return pyximc.Result.Ok
+	
+	def get_engine_settings(self, device_id, settings_ref):
+		self._call()
+		_copy_structure(self._device(device_id).engine_settings, settings_ref._obj)
+		return pyximc.Result.Ok
+	
+	def set_engine_settings(self, device_id, settings_ref):
+		self._call()
+		_copy_structure(settings_ref._obj, self._device(device_id).engine_settings)
+		return pyximc.Result.Ok
+	
+	def get_move_settings(self, device_id, settings_ref):
+		self._call()
+		_copy_structure(self._device(device_id).move_settings, settings_ref._obj)
+		return pyximc.Result.Ok
+	
+	def set_move_settings(self, device_id, settings_ref):
+		self._call()
+		with self._lock: # Movements that did not start yet will use the new settings.
+			_copy_structure(settings_ref._obj, self._device(device_id).move_settings)
+		return pyximc.Result.Ok
+	
+	def get_sync_out_settings(self, device_id, settings_ref):
+		self._call()
+		_copy_structure(self._device(device_id).sync_out_settings, settings_ref._obj)
+		return pyximc.Result.Ok
+	
+	def set_sync_out_settings(self, device_id, settings_ref):
+		self._call()
+		_copy_structure(settings_ref._obj, self._device(device_id).sync_out_settings)
+		return pyximc.Result.Ok
+	
+	def get_sync_in_settings(self, device_id, settings_ref):
+		self._call()
+		_copy_structure(self._device(device_id).sync_in_settings, settings_ref._obj)
+		return pyximc.Result.Ok
+	
+	def set_sync_in_settings(self, device_id, settings_ref):
+		self._call()
+		_copy_structure(settings_ref._obj, self._device(device_id).sync_in_settings)
+		return pyximc.Result.Ok
+	
+	def get_serial_number(self, device_id, serial_number_ref):
+		self._call()
+		serial_number_ref._obj.value = self._device(device_id).serial_number
+		return pyximc.Result.Ok
+	
+	def get_device_information(self, device_id, information_ref):
+		self._call()
+		self._device(device_id)
+		information = information_ref._obj
+		information.Manufacturer = b'XIMC'
+		information.ManufacturerId = b'SM'
+		information.ProductDescription = b'SIMULATD'
+		information.Major, information.Minor, information.Release = 4, 6, 0
+		return pyximc.Result.Ok
+
+class SimulatedUSBError(OSError):
+	"""Raised by `SimulatedLaserUSBDevice` to emulate a failed USB transfer."""
+
+class _SimulatedEndpoint:
+	def __init__(self, device):
+		self._device = device
+	
+	def read(self, size_or_buffer=64, timeout=None):
+		return self._device._read(size_or_buffer)
+
+class _SimulatedInterface:
+	bInterfaceNumber = 0
+	def __init__(self, device):
+		self._endpoint = _SimulatedEndpoint(device)
+	
+	def endpoints(self):
+		return (self._endpoint,)
+
+class _SimulatedConfiguration:
+	def __init__(self, device):
+		self._interface = _SimulatedInterface(device)
+	
+	def interfaces(self):
+		return (self._interface,)
+
+class SimulatedLaserUSBDevice:
+	"""Simulator of the USB device of the Particulars laser controller,
+	to be used as `ParticularsLaserController(device=SimulatedLaserUSBDevice())`.
+	It decodes the packets that are sent to it and keeps the state of
+	the laser (on/off, frequency, DAC), which is reported back when the
+	status is read. Like the real one, the first read after sending a 
+	command returns the previous status, that's why the status is read
+	twice. Latency and failures can be injected.
+	"""
+	def __init__(self, latency: float=0, read_failure_probability: float=0, write_failure_probability: float=0, seed: int=None):
+		"""Create an instance of `SimulatedLaserUSBDevice`.
+		
+		Parameters
+		----------
+		latency: float, default 0
+			Time in seconds that each transfer takes.
+		read_failure_probability: float, default 0
+			Probability that reading the status raises `SimulatedUSBError`.
+		write_failure_probability: float, default 0
+			Probability that a packet is not sent completely, in which
+			case `ctrl_transfer` reports less bytes and the packet is lost.
+		seed: int, optional
+			Seed for the random failures, for reproducibility.
+		"""
+		for name, probability in [('read_failure_probability', read_failure_probability), ('write_failure_probability', write_failure_probability)]:
+			if not 0 <= probability <= 1:
+				raise ValueError(f'`{name}` must be between 0 and 1, received {repr(probability)}.')
+		self.latency = latency
+		self.read_failure_probability = read_failure_probability
+		self.write_failure_probability = write_failure_probability
+		self._random = random.Random(seed)
+		self._configuration = _SimulatedConfiguration(self)
+		# State of the laser ---
+		self.is_on = False
+		self.DAC_enabled = False
+		self.frequency_divider = None
+		self.DAC = None
+		# Statistics ---
+		self.packets = deque(maxlen=1000) # The last packets received, decoded as `(name, value)`.
+		self.transfers_count = 0
+		self.reads_count = 0
+		self._last_status_packet = self._status_packet()
+	
+	@property
+	def frequency(self):
+		"""Frequency in Hz, from the last frequency command received."""
+		if self.frequency_divider is None:
+			return None
+		return 500000000/(self.frequency_divider*180 + 440) # Inverse of what `ParticularsLaserController._set_frequency` does.
+	
+	def __getitem__(self, i):
+		if i != 0:
+			raise IndexError(f'The simulated laser has only one configuration.')
+		return self._configuration
+	
+	def is_kernel_driver_active(self, interface_number):
+		return False
+	
+	def detach_kernel_driver(self, interface_number):
+		pass
+	
+	def _status_packet(self):
+		packet = [0]*64
+		packet[6] = 1 if self.is_on else 0 # `STATUS_BIT` in `ParticularsLaserController.status`.
+		return packet
+	
+	def _wait(self):
+		if self.latency > 0:
+			time.sleep(self.latency)
+	
+	def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+		self._wait()
+		self.transfers_count += 1
+		packet = list(data_or_wLength)
+		if self._random.random() < self.write_failure_probability:
+			return len(packet)//2
+		self._last_status_packet = self._status_packet() # The first read after a command returns the status from before it.
+		command = packet[0]
+		if command == 99:
+			self.frequency_divider = packet[1] | packet[2]<<8
+			self.packets.append(('frequency', self.frequency))
+		elif command == 94:
+			self.DAC = packet[1] | packet[2]<<8
+			self.packets.append(('DAC', self.DAC))
+		elif command == 92:
+			self.DAC_enabled = True
+			self.packets.append(('enable DAC', None))
+		elif command == 93:
+			self.DAC_enabled = False
+			self.packets.append(('disable DAC', None))
+		elif command == 91:
+			self.is_on = True
+			self.packets.append(('hardware sequence enable', None))
+		elif command == 90:
+			self.is_on = False
+			self.packets.append(('hardware sequence disable', None))
+		elif command == 4:
+			self.packets.append(('stop', None))
+		else:
+			self.packets.append(('unknown', packet[:3]))
+		return len(packet)
+	
+	def _read(self, size):
+		self._wait()
+		self.reads_count += 1
+		if self._random.random() < self.read_failure_probability:
+			raise SimulatedUSBError(f'Simulated failure reading from the laser.')
+		packet, self._last_status_packet = self._last_status_packet, self._status_packet()
+		return packet[:size]
@@ -1,36 +1,205 @@
 import sys
 import time
 import ctypes
-import math
+import functools
 import warnings
 from pathlib import Path
 import atexit
 import numpy as np
 import platform
+from concurrent.futures import ThreadPoolExecutor
+from .scan_planning import serpentine_grid, optimize_scan_order, approach_plan, MoveTimeModel
 
 if sys.version_info >= (3,0):
 	import urllib.parse
 
-pyximc_path = Path(__file__).parent/Path('ximc')
-sys.path.append(str(pyximc_path))
+from .ximc import pyximc, bindings # The shared library is loaded when it is first used, see `pyximc.load_lib`.
+from .sampling import PositionSampler, FlyScan, TelemetryRecorder
 
-import pyximc
+TEMPORARY_FILES_PATH = (Path.home()/Path('.PyticularsTCT')).resolve() # Created when the first `Stage` is opened.
 
-TEMPORARY_FILES_PATH = (Path.home()/Path('.PyticularsTCT')).resolve()
-TEMPORARY_FILES_PATH.mkdir(parents=True, exist_ok=True)
+class StageCalibration:
+	"""Conversion between meters and the `(steps, usteps)` used by the
+	stages. All the methods work both with single numbers and with NumPy
+	arrays, so whole scan plans can be converted at once."""
+	def __init__(self, meters_per_step: float=2.5e-6, usteps_per_step: int=2**8):
+		"""Create a calibration.
+		
+		Parameters
+		----------
+		meters_per_step: float, default 2.5e-6
+			Displacement of the stage for one (full) step of the motor.
+		usteps_per_step: int, default 256
+			Number of micro steps in one step, this is given by the 
+			microstep mode of the controller.
+		"""
+		if not meters_per_step > 0:
+			raise ValueError(f'`meters_per_step` must be positive, received {meters_per_step}.')
+		if not isinstance(usteps_per_step, int) or usteps_per_step < 1:
+			raise ValueError(f'`usteps_per_step` must be a positive integer, received {repr(usteps_per_step)}.')
+		self.meters_per_step = float(meters_per_step)
+		self.usteps_per_step = usteps_per_step
+	
+	@classmethod
+	def from_calibration_t(cls, calibration):
+		"""Create a calibration from a `pyximc.calibration_t` structure,
+		in which `A` is the number of meters per step and `MicrostepMode`
+		is one of `pyximc.MicrostepMode`."""
+		return cls(meters_per_step=calibration.A, usteps_per_step=usteps_per_step_from_microstep_mode(calibration.MicrostepMode))
+	
+	def to_calibration_t(self):
+		"""Return the equivalent `pyximc.calibration_t` structure."""
+		return pyximc.calibration_t(A=self.meters_per_step, MicrostepMode=self.usteps_per_step.bit_length())
+	
+	def m2steps(self, m, relative: bool=False):
+		"""Convert meters to `(steps, usteps)`, rounding to the closest 
+		micro step. If `relative` is `False` then `usteps` is always in
+		`[0, usteps_per_step)`, e.g. -1.25 steps is (-2, 192), which is 
+		what `command_move` expects for absolute positions. If `relative`
+		is `True` then both `steps` and `usteps` have the sign of `m`, 
+		e.g. -1.25 steps is (-1, -64), which is what `command_movr` 
+		expects for displacements. If `m` is a number two `int` are 
+		returned, if it is an array two arrays of integers are returned.
+		"""
+		if isinstance(m, (int, float)): # Fast path for numbers.
+			if relative and m < 0:
+				steps, usteps = self.m2steps(-m)
+				return -steps, -usteps
+			usteps_total = round(m/self.meters_per_step*self.usteps_per_step)
+			return usteps_total//self.usteps_per_step, usteps_total%self.usteps_per_step
+		m = np.asarray(m, dtype=float)
+		usteps_total = np.rint((np.abs(m) if relative else m)/self.meters_per_step*self.usteps_per_step).astype(np.int64)
+		steps, usteps = np.divmod(usteps_total, self.usteps_per_step)
+		if relative:
+			sign = np.where(m < 0, -1, 1)
+			steps, usteps = sign*steps, sign*usteps
+		if steps.ndim == 0:
+			return int(steps), int(usteps)
+		return steps, usteps
+	
+	def steps2m(self, steps, usteps):
+		"""Convert `(steps, usteps)` to meters. This is the exact inverse
+		of `m2steps`, i.e. `m2steps(*steps2m(steps, usteps)) == (steps, usteps)`."""
+		if isinstance(steps, int) and isinstance(usteps, int): # Fast path for numbers.
+			return (steps*self.usteps_per_step + usteps)*self.meters_per_step/self.usteps_per_step
+		return (np.asarray(steps, dtype=np.int64)*self.usteps_per_step + np.asarray(usteps, dtype=np.int64))*self.meters_per_step/self.usteps_per_step
+	
+	def __repr__(self):
+		return f'StageCalibration(meters_per_step={self.meters_per_step}, usteps_per_step={self.usteps_per_step})'
+
+def usteps_per_step_from_microstep_mode(microstep_mode: int):
+	"""Return the number of micro steps in one step for one of the
+	`pyximc.MicrostepMode` values, e.g. `MICROSTEP_MODE_FRAC_256` gives 256."""
+	if not pyximc.MicrostepMode.MICROSTEP_MODE_FULL <= microstep_mode <= pyximc.MicrostepMode.MICROSTEP_MODE_FRAC_256:
+		raise ValueError(f'Unknown microstep mode {microstep_mode}.')
+	return 2**(microstep_mode-1)
 
-def m2steps(m: float):
-	# Converts "meters" to "steps".
-	return math.floor(m*1e6/2.5), int((m*1e6/2.5-math.floor(m*1e6/2.5))*2**8)
+DEFAULT_CALIBRATION = StageCalibration() # This is what the stages in our setup use.
+
+def m2steps(m: float, relative: bool=False):
+	# Converts "meters" to "steps" using `DEFAULT_CALIBRATION`, see `StageCalibration.m2steps`.
+	return DEFAULT_CALIBRATION.m2steps(m, relative=relative)
 
 def steps2m(steps, usteps):
-	# Converts "steps" to "meters".
-	return steps*2.5*1e-6 + usteps*2.5*1e-6/2**8
+	# Converts "steps" to "meters" using `DEFAULT_CALIBRATION`.
+	return DEFAULT_CALIBRATION.steps2m(steps, usteps)
+
+MOTION_PROFILES = { # Presets for `Stage.motion_profile`, in meters, seconds and combinations of them. These values are only a starting point, they were not tuned on real stages, so adjust them for yours.
+	'fast-traverse': {'speed': 5e-3, 'acceleration': 25e-3, 'deceleration': 25e-3}, # For long jumps, e.g. between regions of interest.
+	'precise': {'speed': .5e-3, 'acceleration': 2.5e-3, 'deceleration': 2.5e-3}, # For short movements, e.g. between the points of a scan.
+}
+
+def _has_stopped(status):
+	# `True` if the stage of `status`, a `status_t`, is not executing any movement and its speed is 0.
+	return not (status.MoveSts & pyximc.MoveState.MOVE_STATE_MOVING or status.MvCmdSts & pyximc.MvcmdStatus.MVCMD_RUNNING) and status.CurSpeed == status.uCurSpeed == 0
+
+def wait_for_stop(stages, poll_interval: float=10e-3, timeout: float=None, settle_time: float=0, settle_tolerance: float=0):
+	"""Block the execution of the program until all the stages stop 
+	moving, polling their status.
+	
+	Parameters
+	----------
+	stages: list of Stage
+		The stages to wait for.
+	poll_interval: float, default 10e-3
+		Time in seconds to sleep between each reading of the status of
+		the stages. Use 0 to poll as fast as possible.
+	timeout: float, optional
+		Maximum time in seconds to wait. If the stages are still moving
+		after this time they are told to stop, decelerating (see 
+		`command_sstp` in the ximc library), and a `TimeoutError` is 
+		raised. If `None` it waits forever.
+	settle_time: float, default 0
+		After a stage stops it is considered to have arrived only once its
+		speed is 0 and its position has not changed for this amount of
+		time, in seconds.
+	settle_tolerance: float, default 0
+		Maximum change in the position, in meters, that is still 
+		considered as "not changed" for `settle_time`.
+	"""
+	stages = list(stages)
+	ERROR = pyximc.MvcmdStatus.MVCMD_ERROR
+	time_started = time.monotonic()
+	settled_since = [None]*len(stages)
+	settled_position = [None]*len(stages)
+	while True:
+		now = time.monotonic()
+		for i,stage in enumerate(stages):
+			if settled_since[i] is not None and now-settled_since[i] >= settle_time:
+				continue # This one already arrived.
+			stage._read_status()
+			status = stage._status_buffer
+			if status.MvCmdSts & ERROR:
+				raise RuntimeError(f'The stage in port {repr(stage.port)} reports an error in its last movement command (`MvCmdSts={status.MvCmdSts}`).')
+			stopped = _has_stopped(status)
+			position = stage.calibration.steps2m(status.CurPosition, status.uCurPosition)
+			if not stopped or (settled_position[i] is not None and abs(position-settled_position[i]) > settle_tolerance):
+				settled_since[i] = None
+			elif settled_since[i] is None:
+				settled_since[i] = now
+				settled_position[i] = position
+		if all(t is not None and now-t >= settle_time for t in settled_since):
+			return
+		if timeout is not None and now-time_started > timeout:
+			not_stopped = [stage for stage,t in zip(stages,settled_since) if t is None or now-t < settle_time]
+			for stage in not_stopped: # Don't leave them moving.
+				stage._movement_commands_count += 1 # It will not end where it was commanded to.
+				stage._lib.command_sstp(stage._dev_id)
+			raise TimeoutError(f'The stages in ports {[stage.port for stage in not_stopped]} did not stop within {timeout} s, they were told to stop.')
+		time.sleep(poll_interval)
+
+def _construct_concurrently(constructors: dict):
+	"""Call each function in `constructors`, a dictionary of the form
+	`{name: function}`, in its own thread and wait for all of them. Used
+	to open several devices at the same time. Returns `(objects, times)`,
+	two dictionaries with what each function returned and how long it 
+	took, in seconds. If any of them fails, the objects that were already
+	created are closed and the exception is raised."""
+	def timed(constructor):
+		time_started = time.perf_counter()
+		obj = constructor()
+		return obj, time.perf_counter() - time_started
+	with ThreadPoolExecutor(max_workers=len(constructors), thread_name_prefix='PyticularsTCT_open') as executor:
+		futures = {name: executor.submit(timed, constructor) for name,constructor in constructors.items()}
+	objects = {}
+	times = {}
+	errors = []
+	for name,future in futures.items():
+		try:
+			objects[name], times[name] = future.result()
+		except Exception as e:
+			errors.append(e)
+	if len(errors) > 0:
+		for obj in objects.values():
+			if hasattr(obj, 'close'):
+				obj.close()
+		raise errors[0]
+	return objects, times
 
 class Stage:
 	"""A class to control the stages that are used in the TCT setup."""
 	# https://libximc.xisupport.com/doc-en/index.html
-	def __init__(self, port: str):
+	def __init__(self, port: str, meters_per_step: float=2.5e-6, backend=None):
 		"""Create an instance of `Stage`.
 		
 		Parameters
@@ -39,6 +208,14 @@ class Stage:
 			A string with the port name. If you are in Linux it will look
 			something like `"dev/ttyACM2"`, if you are in Windows it should
 			be something like `"COM2"`. 
+		meters_per_step: float, default 2.5e-6
+			Displacement of the stage for each step of the motor. The 
+			number of micro steps per step is read from the controller.
+		backend: optional
+			An object with the same functions as `pyximc.lib` to which
+			all the calls are sent, e.g. a `SimulatedXimc` from 
+			`simulation.py` to work without the real stages. If `None`,
+			the ximc library is used.
 		"""
 		if not isinstance(port, str):
 			raise TypeError(f'`port` must be a string but received object of type {type(port)}.')
@@ -47,24 +224,83 @@ class Stage:
 				return b'xi-com:\\\\.\\'+(bytes(port, 'utf8'))
 			elif platform.system() in {'Linux','Darwin'}:
 				return b'xi-com:'+(bytes(port, 'utf8'))
-		self._dev_id = pyximc.lib.open_device(create_uri(port)) # https://libximc.xisupport.com/doc-en/ximc_8h.html#a9027dc684f63de34956488bffe9e4b36
+		self.port = port
+		self._lib = bindings.bind(pyximc.lib if backend is None else backend) # Errors returned by the library raise a `bindings.XimcError`.
+		self._dev_id = self._lib.open_device(create_uri(port)) # https://libximc.xisupport.com/doc-en/ximc_8h.html#a9027dc684f63de34956488bffe9e4b36
+		self._closed = False
+		self._busy_file = None
 		
+		TEMPORARY_FILES_PATH.mkdir(parents=True, exist_ok=True)
 		temporary_file_to_indicate_that_this_stage_is_busy = TEMPORARY_FILES_PATH/Path(f'Pyticulars__stage_{port.replace("/","_")}_is_busy__')
 		if temporary_file_to_indicate_that_this_stage_is_busy.is_file():
 			raise RuntimeError(f'Cannot open stage in port {repr(port)} because it seems to be already in use. If it is not in use, please manually delete the file {repr(temporary_file_to_indicate_that_this_stage_is_busy)}')
 		with open(temporary_file_to_indicate_that_this_stage_is_busy, 'w') as tempfile:
 			print('delete me', file=tempfile)
-		atexit.register(lambda: temporary_file_to_indicate_that_this_stage_is_busy.unlink()) # Delete the temporary file when this instance is destroyed.
+		self._busy_file = temporary_file_to_indicate_that_this_stage_is_busy
+		self._delete_busy_file_at_exit = lambda: temporary_file_to_indicate_that_this_stage_is_busy.unlink(missing_ok=True)
+		atexit.register(self._delete_busy_file_at_exit) # Delete the temporary file when the program ends, if `close` was not called. `close` unregisters it, otherwise it would delete the file of whoever opens the stage next.
 		
+		# Buffers that are reused each time the position or the status is read, so nothing is allocated in tight polling loops ---
+		self._position_buffer = pyximc.get_position_t()
+		self._position_buffer_ref = ctypes.byref(self._position_buffer)
+		self._status_buffer = pyximc.status_t()
+		self._status_buffer_ref = ctypes.byref(self._status_buffer)
+		self._status_array = np.frombuffer(self._status_buffer, dtype=np.dtype(pyximc.status_t)) # This shares the memory with `self._status_buffer`.
+		self._bind_hot_calls()
+		
+		self._movement_commands_count = 0 # Increased each time the stage is told to move, so others can know if it was moved behind their backs.
+		
+		engine_settings = pyximc.engine_settings_t()
+		self._lib.get_engine_settings(self._dev_id, ctypes.byref(engine_settings))
+		try:
+			usteps_per_step = usteps_per_step_from_microstep_mode(engine_settings.MicrostepMode)
+		except ValueError:
+			warnings.warn(f'Cannot understand the microstep mode of the stage in port {repr(port)}, will assume {DEFAULT_CALIBRATION.usteps_per_step} micro steps per step.')
+			usteps_per_step = DEFAULT_CALIBRATION.usteps_per_step
+		self.calibration = StageCalibration(meters_per_step=meters_per_step, usteps_per_step=usteps_per_step)
+		
+		self.wait_for_stop_settings = {} # Default arguments for `wait_for_stop`, e.g. `{'poll_interval': 1e-3, 'timeout': 10}`.
+		self.motion_profiles = {name: dict(profile) for name,profile in MOTION_PROFILES.items()} # Presets for `motion_profile`, you can add your own. When `motion_profile` is first set, what was in the controller is stored as `'default'`.
+		self.telemetry = None # See `start_telemetry`.
+	
+	@property
+	def _lib(self):
+		# The ximc library, or the backend, to which all the calls are sent.
+		return self._lib_
+	@_lib.setter
+	def _lib(self, lib):
+		self._lib_ = lib
+		if hasattr(self, '_status_buffer_ref'): # Otherwise it is done in `__init__` once the buffers exist.
+			self._bind_hot_calls()
+	
+	def _bind_hot_calls(self):
+		# Calls that are used in tight polling loops, with all their arguments already bound. Done again each time `_lib` changes.
+		self._read_status = functools.partial(self._lib.get_status, self._dev_id, self._status_buffer_ref) # Reads into `self._status_buffer`.
+		self._read_position = functools.partial(self._lib.get_position, self._dev_id, self._position_buffer_ref) # Reads into `self._position_buffer`.
+	
+	def close(self):
+		"""Close the connection with the stage and release it, so it can
+		be opened again (e.g. by another program)."""
+		if getattr(self, '_closed', True):
+			return
+		self._closed = True
+		if getattr(self, 'telemetry', None) is not None:
+			self.telemetry.stop()
+		self._lib.close_device(ctypes.byref(ctypes.c_int(self._dev_id)))
+		if self._busy_file is not None:
+			atexit.unregister(self._delete_busy_file_at_exit)
+			self._busy_file.unlink(missing_ok=True)
+	
 	def __del__(self):
-		pyximc.lib.close_device(ctypes.byref(ctypes.c_int(self._dev_id)))
+		self.close()
 	
 	def reset_position(self):
 		"""Resets the coordinates. This makes the stage to travel to the 
 		end, it does some stuff, and then it goes back to the middle 
 		where the 0 position is defined.
 		"""
-		pyximc.lib.command_homezero(self._dev_id)
+		self._movement_commands_count += 1
+		self._lib.command_homezero(self._dev_id)
 	
 	def _move_to(self, steps: int, usteps: int, blocking: bool):
 		"""Moves the stage to the absolute position defined in `steps` and
@@ -85,11 +321,12 @@ class Stage:
 			raise TypeError('<steps> must be an int')
 		if not isinstance(usteps, int):
 			raise TypeError('<usteps> must be an int')
-		if not 0 <= usteps <= 255:
-			raise ValueError('<usteps> must be between 0 and 255 (1 step = 255 usteps)')
-		pyximc.lib.command_move(self._dev_id, steps, usteps) # https://libximc.xisupport.com/doc-en/ximc_8h.html#aa6113a42efa241396c72226bba9acd59
+		if not 0 <= usteps < self.calibration.usteps_per_step:
+			raise ValueError(f'<usteps> must be between 0 and {self.calibration.usteps_per_step-1} (1 step = {self.calibration.usteps_per_step} usteps)')
+		self._movement_commands_count += 1
+		self._lib.command_move(self._dev_id, steps, usteps) # https://libximc.xisupport.com/doc-en/ximc_8h.html#aa6113a42efa241396c72226bba9acd59
 		if blocking == True:
-			pyximc.lib.command_wait_for_stop(self._dev_id, 10) # https://libximc.xisupport.com/doc-en/ximc_8h.html#ad9324f278bf9b97ad85b3411562ef0f7
+			self.wait_for_stop()
 	
 	def _move_rel(self, steps: int, usteps: int, blocking: bool):
 		"""Moves the stage relative to the current position.
@@ -97,9 +334,12 @@ class Stage:
 		Parameters
 		----------
 		steps: int
-			Number of steps to move the stage.
+			Number of steps to move the stage, can be negative.
 		usteps: int
-			Number of micro steps to move the stage.
+			Number of micro steps to move the stage, between -255 and 
+			255 (for 256 micro steps per step). For negative displacements
+			both `steps` and `usteps` should be negative, see 
+			`StageCalibration.m2steps` with `relative=True`.
 		blocking: bool
 			If `True`, the execution of the program is blocked until the
 			stage reaches the final position.
@@ -108,11 +348,34 @@ class Stage:
 			raise TypeError('<steps> must be an int')
 		if not isinstance(usteps, int):
 			raise TypeError('<usteps> must be an int')
-		if not 0 <= usteps <= 255: # Not sure if this can be negative...
-			raise ValueError('<usteps> must be between 0 and 255 (1 step = 255 usteps)')
-		pyximc.lib.command_movr(self._dev_id, steps, usteps)
+		if not -self.calibration.usteps_per_step < usteps < self.calibration.usteps_per_step:
+			raise ValueError(f'<usteps> must be between {-self.calibration.usteps_per_step+1} and {self.calibration.usteps_per_step-1} (1 step = {self.calibration.usteps_per_step} usteps)')
+		self._movement_commands_count += 1
+		self._lib.command_movr(self._dev_id, steps, usteps)
 		if blocking == True:
-			pyximc.lib.command_wait_for_stop(self._dev_id, 10)
+			self.wait_for_stop()
+	
+	def wait_for_stop(self, **settings):
+		"""Block the execution of the program until the stage stops 
+		moving. Useful after calling `move_to` or `move_rel` with 
+		`blocking=False`. This is also what is used by all the blocking
+		movements.
+		
+		Parameters
+		----------
+		**settings:
+			Any of the arguments `poll_interval`, `timeout`, `settle_time` 
+			and `settle_tolerance` of the function `wait_for_stop` in this
+			module. Those not given are taken from the attribute 
+			`wait_for_stop_settings` of the stage. If none of them is given
+			anywhere the waiting is done by the controller library, which
+			polls the stage every 10 ms and never times out.
+		"""
+		settings = {**self.wait_for_stop_settings, **settings}
+		if len(settings) == 0:
+			self._lib.command_wait_for_stop(self._dev_id, 10) # https://libximc.xisupport.com/doc-en/ximc_8h.html#ad9324f278bf9b97ad85b3411562ef0f7
+		else:
+			wait_for_stop([self], **settings)
 	
 	def move_to(self, m: float, blocking: bool=True):
 		"""Move the stage to some absolute position defined in meters.
@@ -127,7 +390,7 @@ class Stage:
 		"""
 		if not (isinstance(m, float) or isinstance(m, int)):
 			raise ValueError(f'Position must be a float number, received object of type {type(m)}.')
-		steps, usteps = m2steps(m)
+		steps, usteps = self.calibration.m2steps(m)
 		self._move_to(steps, usteps, blocking = blocking)
 	
 	def move_rel(self, m, blocking=True):
@@ -143,11 +406,100 @@ class Stage:
 		"""
 		if not (isinstance(m, float) or isinstance(m, int)):
 			raise ValueError(f'Position must be a float number, received object of type {type(m)}.')
-		steps, usteps = m2steps(m)
+		steps, usteps = self.calibration.m2steps(m, relative=True)
 		if steps == usteps == 0:
 			warnings.warn(f'I was told to move the stage in <m>={m} meters (relative to its current position) and this is less than the minimum step of the stage, thus it will not be moved.')
 		self._move_rel(steps, usteps, blocking = blocking)
 	
+	def stream_moves(self, positions, max_in_flight: int=1, poll_interval: float=1e-3, timeout: float=None):
+		"""Move the stage through a sequence of absolute positions, 
+		sending each movement command as soon as the previous target is
+		reached, without waiting for the stage to stop. If the controller
+		queues commands (see `max_in_flight`) they are sent ahead of time
+		into its command buffer (see `status_t.CmdBufFreeSpace`) so there
+		is no round trip with the computer between consecutive segments.
+		This is a generator that yields the index of each segment as 
+		soon as the stage reaches (or passes, in the direction of the 
+		segment) its target or starts the next one. The last one is 
+		yielded once the stage stopped, as in `wait_for_stop`. Usage 
+		example:
+		```
+		for i in stage.stream_moves(np.linspace(0, 1e-3, 1001)):
+			print(f'Arrived to point {i}')
+		```
+		
+		Parameters
+		----------
+		positions: array like of float
+			Absolute positions in meters, in the order to visit them.
+		max_in_flight: int, default 1
+			Maximum number of segments that were sent but not yet 
+			reached. With `1` each segment is sent as soon as the previous
+			target is reached, which works with any controller. Only if
+			the firmware of your controller queues the movement commands
+			in the command buffer (i.e. `CmdBufFreeSpace` decreases when a
+			command is sent while moving) use a larger number, or `None`
+			to be limited only by the free space in the command buffer. 
+			Otherwise each new command replaces the current target and the
+			intermediate segments are skipped.
+		poll_interval: float, default 1e-3
+			Time in seconds to sleep between each reading of the status.
+		timeout: float, optional
+			Maximum time in seconds for the whole sequence, if exceeded a
+			`TimeoutError` is raised. If `None` it waits forever.
+		
+		Yields
+		------
+		index: int
+			Index in `positions` of the segment that was completed.
+		"""
+		if max_in_flight is not None and not (isinstance(max_in_flight, int) and max_in_flight > 0):
+			raise ValueError(f'`max_in_flight` must be a positive integer or `None`, received {repr(max_in_flight)}.')
+		steps, usteps = self.calibration.m2steps(np.atleast_1d(np.asarray(positions, dtype=float)))
+		if steps.ndim != 1:
+			raise ValueError(f'`positions` must be a one dimensional list of positions.')
+		steps, usteps = steps.tolist(), usteps.tolist()
+		targets = [st*self.calibration.usteps_per_step + ust for st,ust in zip(steps, usteps)] # In micro steps, to compare with the status.
+		MOVING = pyximc.MoveState.MOVE_STATE_MOVING
+		RUNNING = pyximc.MvcmdStatus.MVCMD_RUNNING
+		ERROR = pyximc.MvcmdStatus.MVCMD_ERROR
+		status = self._status_buffer
+		
+		self._read_status()
+		origins = [status.CurPosition*self.calibration.usteps_per_step + status.uCurPosition] + targets[:-1] # Where each segment starts.
+		directions = [(target>origin)-(target<origin) for origin,target in zip(origins, targets)]
+		buffer_size = status.CmdBufFreeSpace # Assuming nothing is pending now.
+		if buffer_size == 0 and (status.MoveSts & MOVING or status.MvCmdSts & RUNNING):
+			raise RuntimeError(f'The stage in port {repr(self.port)} is still executing a previous movement and its command buffer has no free space (`CmdBufFreeSpace=0`), cannot stream movements. Wait for it to stop first.')
+		
+		n_sent = 0
+		n_done = 0
+		time_started = time.monotonic()
+		while n_done < len(targets):
+			# Refill the buffer of the controller ---
+			while n_sent < len(targets) and (status.CmdBufFreeSpace > 0 or (n_sent == n_done and not (status.MoveSts & MOVING or status.MvCmdSts & RUNNING))) and (max_in_flight is None or n_sent-n_done < max_in_flight): # If the stage is idle the next one can always be sent, even if the controller has no free space in its command buffer.
+				self._move_to(steps[n_sent], usteps[n_sent], blocking=False)
+				n_sent += 1
+				self._read_status()
+			# Check which segments were completed ---
+			position = status.CurPosition*self.calibration.usteps_per_step + status.uCurPosition
+			n_started = n_sent - max(0, buffer_size-status.CmdBufFreeSpace) # Those that left the buffer of the controller.
+			stopped = _has_stopped(status) and n_started == n_sent
+			while n_done < n_started:
+				if n_done+1 < n_started or (n_done+1 < len(targets) and (position-targets[n_done])*directions[n_done] >= 0) or stopped: # The next one already started, or this one (not the last) reached/passed its target, or everything finished.
+					yield n_done
+					n_done += 1
+				else:
+					break
+			if n_done == len(targets):
+				break
+			if status.MvCmdSts & ERROR:
+				raise RuntimeError(f'The stage in port {repr(self.port)} reports an error in its last movement command (`MvCmdSts={status.MvCmdSts}`).')
+			if timeout is not None and time.monotonic()-time_started > timeout:
+				raise TimeoutError(f'The stage in port {repr(self.port)} completed only {n_done} of {len(targets)} segments within {timeout} s.')
+			time.sleep(poll_interval)
+			self._read_status()
+	
 	def get_position(self):
 		"""Returns the position of the stage. Returns a dictionary of 
 		the form
@@ -158,15 +510,52 @@ class Stage:
 		measured in micro-steps. I don't know what `'EncPosition'` has,
 		never used it.
 		"""
-		pos = pyximc.get_position_t()
-		pyximc.lib.get_position(self._dev_id, ctypes.byref(pos))
+		self._read_position()
+		pos = self._position_buffer
 		return {'Position': pos.Position, 'uPosition': pos.uPosition, 'EncPosition': pos.EncPosition}
 	
+	def get_status(self, format: str='dict'):
+		"""Read the status of the stage. Everything is read from the
+		controller in a single call (position, speed, movement state, 
+		temperature, power supply, free space in the command buffer, etc.)
+		into a buffer that is reused in each call.
+		
+		Parameters
+		----------
+		format: str, default 'dict'
+			How to return the status, options are:
+			- `'dict'`: A dictionary with all the fields of `pyximc.status_t`,
+			e.g. `{'MoveSts': int, 'CurPosition': int, 'uCurPosition': int, 'CurSpeed': int, 'CurT': int, 'CmdBufFreeSpace': int, ...}`.
+			- `'tuple'`: A compact tuple of the form `(position, speed, is_moving, cmd_buf_free_space)`
+			where `position` is in meters, `speed` is in meters per second,
+			`is_moving` is a bool and `cmd_buf_free_space` is an int.
+			- `'numpy'`: A NumPy structured array of length 1 with the 
+			same fields as `'dict'`. Nothing is allocated, this array 
+			shares the memory with the internal buffer so it is 
+			overwritten each time `get_status` is called. Use `.copy()`
+			if you want to keep it.
+		"""
+		self._read_status()
+		status = self._status_buffer
+		if format == 'tuple':
+			return (
+				self.calibration.steps2m(status.CurPosition, status.uCurPosition),
+				self.calibration.steps2m(status.CurSpeed, status.uCurSpeed),
+				bool(status.MoveSts & pyximc.MoveState.MOVE_STATE_MOVING),
+				status.CmdBufFreeSpace,
+			)
+		elif format == 'numpy':
+			return self._status_array
+		elif format == 'dict':
+			return {field: getattr(status, field) for field,_ in status._fields_}
+		else:
+			raise ValueError(f'`format` must be one of {{"dict","tuple","numpy"}}, received {repr(format)}.')
+	
 	@property
 	def serial_number(self):
 		"""Returns the serial number of the stage."""
 		serial_number = ctypes.c_uint(100)
-		pyximc.lib.get_serial_number(self._dev_id, ctypes.byref(serial_number))
+		self._lib.get_serial_number(self._dev_id, ctypes.byref(serial_number))
 		return serial_number.value
 	
 	@property
@@ -174,7 +563,7 @@ class Stage:
 		"""Returns a dictionary with general information about the stage
 		such as manufacturer name, firmware version, etc."""
 		info = pyximc.device_information_t()
-		pyximc.lib.get_device_information(self._dev_id, ctypes.byref(info))
+		self._lib.get_device_information(self._dev_id, ctypes.byref(info))
 		return {
 			"Manufacturer": info.Manufacturer.decode("utf-8"),
 			"ManufacturerId": info.ManufacturerId.decode("utf-8"),
@@ -188,12 +577,247 @@ class Stage:
 	def position(self):
 		"""Returns the position of the stage in meters as a float number.
 		"""
-		pos = self.get_position()
-		return steps2m(pos['Position'], pos['uPosition'])
+		self._read_position()
+		return self.calibration.steps2m(self._position_buffer.Position, self._position_buffer.uPosition)
+	
+	def _read_position_and_stopped(self):
+		"""Read the status once and return `(position, stopped)`, the 
+		position in meters and whether the stage has stopped (see 
+		`wait_for_stop`)."""
+		self._read_status()
+		status = self._status_buffer
+		return self.calibration.steps2m(status.CurPosition, status.uCurPosition), _has_stopped(status)
+	
+	@property
+	def motion_profile(self):
+		"""Returns a dictionary with the speed (m/s), acceleration (m/s^2),
+		deceleration (m/s^2) and antiplay speed (m/s) that the stage uses
+		when it moves, i.e. the `pyximc.move_settings_t` of the controller.
+		The dictionary is of the form
+		```
+		{'speed': float, 'acceleration': float, 'deceleration': float, 'antiplay_speed': float}
+		```
+		"""
+		move_settings = pyximc.move_settings_t()
+		self._lib.get_move_settings(self._dev_id, ctypes.byref(move_settings))
+		return {
+			'speed': self.calibration.steps2m(move_settings.Speed, move_settings.uSpeed),
+			'acceleration': self.calibration.steps2m(move_settings.Accel, 0),
+			'deceleration': self.calibration.steps2m(move_settings.Decel, 0),
+			'antiplay_speed': self.calibration.steps2m(move_settings.AntiplaySpeed, move_settings.uAntiplaySpeed),
+		}
+	@motion_profile.setter
+	def motion_profile(self, profile):
+		"""Set the speed, acceleration, etc. used when moving.
+		
+		Parameters
+		----------
+		profile: str or dict
+			Either the name of one of the profiles in `motion_profiles`, 
+			e.g. `'fast-traverse'` or `'precise'`, or a dictionary with 
+			any of the keys returned by `motion_profile`. Values that are
+			not in the dictionary are not changed.
+		"""
+		if isinstance(profile, str):
+			if profile not in self.motion_profiles:
+				raise ValueError(f'Unknown motion profile {repr(profile)}, available profiles are {sorted(self.motion_profiles)}.')
+			name, profile = profile, self.motion_profiles[profile]
+		else:
+			name = None
+		if not isinstance(profile, dict) or any(key not in {'speed','acceleration','deceleration','antiplay_speed'} for key in profile):
+			raise ValueError(f'`profile` must be the name of a motion profile or a dictionary with keys {{"speed","acceleration","deceleration","antiplay_speed"}}, received {repr(profile)}.')
+		if any(not value > 0 for value in profile.values()):
+			raise ValueError(f'All the values in a motion profile must be positive, received {profile}.')
+		if 'default' not in self.motion_profiles: # Store whatever was there before we touched anything.
+			self.motion_profiles['default'] = self.motion_profile
+		move_settings = pyximc.move_settings_t()
+		self._lib.get_move_settings(self._dev_id, ctypes.byref(move_settings))
+		if 'speed' in profile:
+			move_settings.Speed, move_settings.uSpeed = self.calibration.m2steps(profile['speed'])
+		if 'acceleration' in profile:
+			move_settings.Accel = max(1, round(profile['acceleration']/self.calibration.meters_per_step))
+		if 'deceleration' in profile:
+			move_settings.Decel = max(1, round(profile['deceleration']/self.calibration.meters_per_step))
+		if 'antiplay_speed' in profile:
+			move_settings.AntiplaySpeed, move_settings.uAntiplaySpeed = self.calibration.m2steps(profile['antiplay_speed'])
+		self._lib.set_move_settings(self._dev_id, ctypes.byref(move_settings))
+		self._motion_profile_name = name
+	
+	def use_motion_profile(self, name: str):
+		"""Same as `motion_profile = name` but does nothing if the profile
+		`name` was the last one set, so it can be called before each 
+		movement without communicating with the controller each time."""
+		if getattr(self, '_motion_profile_name', None) != name:
+			self.motion_profile = name
+	
+	@property
+	def antiplay(self):
+		"""Returns the distance, in meters, that the controller uses for
+		its backlash (play) compensation, i.e. `engine_settings_t.Antiplay`.
+		The sign indicates the direction in which the targets are finally
+		approached. This is used only if the `ENGINE_ANTIPLAY` flag is set
+		in the controller."""
+		engine_settings = pyximc.engine_settings_t()
+		self._lib.get_engine_settings(self._dev_id, ctypes.byref(engine_settings))
+		return self.calibration.steps2m(engine_settings.Antiplay, 0)
+	
+	def start_telemetry(self, interval: float=1, capacity: int=3600):
+		"""Start recording the status of the stage (position, speed, 
+		temperature, power supply, etc.) in the background into a ring 
+		buffer of fixed size. The records are read from `telemetry`.
+		
+		Parameters
+		----------
+		interval, capacity:
+			See `TelemetryRecorder` in `sampling.py`.
+		
+		Returns
+		-------
+		telemetry: TelemetryRecorder
+			The same object that is in `telemetry`.
+		"""
+		self.stop_telemetry()
+		self.telemetry = TelemetryRecorder(self, interval=interval, capacity=capacity)
+		self.telemetry.start()
+		return self.telemetry
+	
+	def stop_telemetry(self):
+		"""Stop recording the status of the stage. What was recorded is
+		still available in `telemetry`."""
+		if self.telemetry is not None:
+			self.telemetry.stop()
+	
+	@property
+	def sync_out_settings(self):
+		"""Returns a dictionary with the configuration of the sync out
+		output of the controller, i.e. its `pyximc.sync_out_settings_t`,
+		of the form
+		```
+		{'enabled': bool, 'period': float, 'pulse_duration': float, 'on_start': bool, 'on_stop': bool, 'invert': bool}
+		```
+		where `period` is in meters and `pulse_duration` in seconds. See
+		`configure_sync_out`.
+		"""
+		settings = pyximc.sync_out_settings_t()
+		self._lib.get_sync_out_settings(self._dev_id, ctypes.byref(settings))
+		return {
+			'enabled': bool(settings.SyncOutFlags & pyximc.SyncOutFlags.SYNCOUT_ENABLED),
+			'period': self.calibration.steps2m(settings.SyncOutPeriod, 0) if settings.SyncOutFlags & pyximc.SyncOutFlags.SYNCOUT_ONPERIOD else None,
+			'pulse_duration': settings.SyncOutPulseSteps/1e6,
+			'on_start': bool(settings.SyncOutFlags & pyximc.SyncOutFlags.SYNCOUT_ONSTART),
+			'on_stop': bool(settings.SyncOutFlags & pyximc.SyncOutFlags.SYNCOUT_ONSTOP),
+			'invert': bool(settings.SyncOutFlags & pyximc.SyncOutFlags.SYNCOUT_INVERT),
+		}
+	
+	def configure_sync_out(self, period: float=None, pulse_duration: float=10e-6, on_start: bool=False, on_stop: bool=False, invert: bool=False, enabled: bool=True):
+		"""Configure the sync out output of the controller to produce a 
+		pulse each time the stage travels `period` meters, so the 
+		controller itself triggers e.g. the digitizer or the laser with
+		a deterministic spacing during a continuous movement. Usage example:
+		```
+		stage.configure_sync_out(period=10e-6) # One pulse every 10 µm.
+		stage.move_to(1e-3)
+		stage.configure_sync_out(enabled=False)
+		```
+		
+		Parameters
+		----------
+		period: float, optional
+			Distance between pulses, in meters. The controller counts 
+			whole steps, so it is rounded to a multiple of 
+			`calibration.meters_per_step` and a warning is issued if this
+			changes it. If `None` no periodic pulses are produced.
+		pulse_duration: float, default 10e-6
+			Duration of each pulse, in seconds. The resolution is 1 µs.
+		on_start: bool, default False
+			Produce a pulse when a movement starts.
+		on_stop: bool, default False
+			Produce a pulse when a movement finishes.
+		invert: bool, default False
+			If `True` the pulses are low instead of high.
+		enabled: bool, default True
+			If `False` the sync out is disabled and all the other 
+			arguments are ignored.
+		"""
+		settings = pyximc.sync_out_settings_t()
+		self._lib.get_sync_out_settings(self._dev_id, ctypes.byref(settings)) # To keep the fields we don't touch, e.g. `Accuracy`.
+		if not enabled:
+			settings.SyncOutFlags &= ~pyximc.SyncOutFlags.SYNCOUT_ENABLED
+			self._lib.set_sync_out_settings(self._dev_id, ctypes.byref(settings))
+			return
+		flags = pyximc.SyncOutFlags.SYNCOUT_ENABLED
+		if period is not None:
+			if not period > 0:
+				raise ValueError(f'`period` must be a positive number of meters, received {repr(period)}.')
+			period_in_steps = max(1, round(period/self.calibration.meters_per_step))
+			if abs(period_in_steps*self.calibration.meters_per_step - period) > self.calibration.steps2m(0,1):
+				warnings.warn(f'The sync out period can only be a whole number of steps, {period} m was rounded to {period_in_steps*self.calibration.meters_per_step} m.')
+			settings.SyncOutPeriod = period_in_steps
+			flags |= pyximc.SyncOutFlags.SYNCOUT_ONPERIOD
+		if not pulse_duration >= 1e-6:
+			raise ValueError(f'`pulse_duration` must be at least 1e-6 seconds, received {repr(pulse_duration)}.')
+		settings.SyncOutPulseSteps = round(pulse_duration*1e6) # In µs because `SYNCOUT_IN_STEPS` is not set.
+		if on_start:
+			flags |= pyximc.SyncOutFlags.SYNCOUT_ONSTART
+		if on_stop:
+			flags |= pyximc.SyncOutFlags.SYNCOUT_ONSTOP
+		if invert:
+			flags |= pyximc.SyncOutFlags.SYNCOUT_INVERT
+		settings.SyncOutFlags = flags
+		self._lib.set_sync_out_settings(self._dev_id, ctypes.byref(settings))
+	
+	def configure_sync_in(self, m: float=0, relative: bool=True, speed: float=None, clutter_time: float=4e-6, invert: bool=False, enabled: bool=True):
+		"""Configure the sync in input of the controller such that each 
+		pulse received there moves the stage, without any communication
+		with the computer. Note that `TCTStages` cannot know about these
+		movements, so use `TCTStages.refresh` afterwards. Usage example:
+		```
+		stage.configure_sync_in(10e-6) # Each pulse advances the stage 10 µm.
+		... # Do whatever produces the pulses.
+		stage.configure_sync_in(enabled=False)
+		```
+		
+		Parameters
+		----------
+		m: float, default 0
+			Displacement in meters for each pulse if `relative`, otherwise
+			the absolute position in meters to go to when a pulse arrives.
+		relative: bool, default True
+			See `m`.
+		speed: float, optional
+			Speed of the movement in meters per second. If `None` the 
+			current speed of the stage (see `motion_profile`) is used.
+		clutter_time: float, default 4e-6
+			Minimum duration of a pulse, in seconds, to be considered a 
+			pulse and not noise.
+		invert: bool, default False
+			If `True` the falling edge of the pulses triggers the movement.
+		enabled: bool, default True
+			If `False` the sync in is disabled and all the other arguments
+			are ignored.
+		"""
+		settings = pyximc.sync_in_settings_t()
+		if enabled:
+			if not isinstance(m, (int,float)):
+				raise ValueError(f'`m` must be a float number, received object of type {type(m)}.')
+			if not clutter_time >= 0:
+				raise ValueError(f'`clutter_time` must be a non negative number of seconds, received {repr(clutter_time)}.')
+			if speed is not None and not speed > 0:
+				raise ValueError(f'`speed` must be a positive number, received {repr(speed)}.')
+			settings.Position, settings.uPosition = self.calibration.m2steps(m, relative=relative)
+			settings.Speed, settings.uSpeed = self.calibration.m2steps(self.motion_profile['speed'] if speed is None else speed)
+			settings.ClutterTime = round(clutter_time*1e6)
+			settings.SyncInFlags = pyximc.SyncInFlags.SYNCIN_ENABLED
+			if not relative:
+				settings.SyncInFlags |= pyximc.SyncInFlags.SYNCIN_GOTOPOSITION
+			if invert:
+				settings.SyncInFlags |= pyximc.SyncInFlags.SYNCIN_INVERT
+			self._movement_commands_count += 1 # From now on the stage can move behind our backs.
+		self._lib.set_sync_in_settings(self._dev_id, ctypes.byref(settings))
 
 class TCTStages:
 	"""A class to wrap the three xyz stages of the TCT setup."""
-	def __init__(self, x_stage_port, y_stage_port, z_stage_port, x_limits=[-50e-3, 50e-3], y_limits=[-50e-3, 50e-3], z_limits=[0,90e-3]):
+	def __init__(self, x_stage_port, y_stage_port, z_stage_port, x_limits=[-50e-3, 50e-3], y_limits=[-50e-3, 50e-3], z_limits=[0,90e-3], verify_position_every: int=None, fast_traverse_threshold: float=None, backend=None):
 		"""Creates an instance of the class.
 		
 		Parameters:
@@ -211,37 +835,554 @@ class TCTStages:
 			y_limits=[-50e-3, 50e-3]
 			z_limits=[0,90e-3]
 			```
+		verify_position_every: int, optional
+			The position to which the stages were commanded is kept in a 
+			cache, so relative movements don't have to read the position
+			from the stages each time (see `commanded_position`). If an
+			int is given, every that number of movements the position of
+			the stages that were moved is read and compared with the 
+			cache, and a warning is issued if they differ. If `None` (default) this 
+			check is never done.
+		fast_traverse_threshold: float, optional
+			If a distance in meters is given, each stage is switched to
+			the `'fast-traverse'` motion profile before moving more than 
+			this distance and to the `'precise'` profile for shorter
+			movements (see `Stage.motion_profile`). If `None` (default)
+			the motion profile of the stages is never changed.
+		backend: optional
+			Passed to each `Stage`, e.g. a `SimulatedXimc` to work without
+			the real stages.
 		"""
+		time_started = time.perf_counter()
 		# The default values for the limits were found after using the "Stage.reset_position" method. With these numbers there should be no problems.
-		self.x_stage = Stage(port=x_stage_port)
-		self.y_stage = Stage(port=y_stage_port)
-		self.z_stage = Stage(port=z_stage_port)
+		stages, self.startup_times = _construct_concurrently({ # Opening a stage takes a while, so the three are opened at the same time.
+			f'{coord}_stage': functools.partial(Stage, port=port, backend=backend) for coord,port in zip(['x','y','z'], [x_stage_port, y_stage_port, z_stage_port])
+		})
+		self.x_stage = stages['x_stage']
+		self.y_stage = stages['y_stage']
+		self.z_stage = stages['z_stage']
 		self._stages = [self.x_stage, self.y_stage, self.z_stage]
 		self.coordinates_limits = {
 			'x': x_limits,
 			'y': y_limits,
 			'z': z_limits,
 		}
+		if verify_position_every is not None and (not isinstance(verify_position_every, int) or verify_position_every < 1):
+			raise ValueError(f'`verify_position_every` must be a positive integer or `None`, received {repr(verify_position_every)}.')
+		self.verify_position_every = verify_position_every
+		self.fast_traverse_threshold = fast_traverse_threshold
+		self.move_time_model = None # See `estimate_move_time`.
+		self._moves_since_last_verification = 0
+		self.invalidate_position_cache()
+		self.startup_times['total'] = time.perf_counter() - time_started # Seconds that the construction took, `startup_times` also has the time to open each stage.
 	
-	def move_to(self, x: float=None, y: float=None, z:float =None):
+	def _check_limits(self, x=None, y=None, z=None):
+		"""Raise `ValueError` if any of the coordinates is outside its
+		limits. Coordinates that are `None` are not checked."""
+		for pos, coord in zip([x,y,z], ['x','y','z']):
+			if pos is None:
+				continue
+			if not self.coordinates_limits[coord][0] <= pos <= self.coordinates_limits[coord][1]:
+				raise ValueError(f'Coordinate {repr(coord)} must be inside the range {self.coordinates_limits[coord]}, received {pos}.')
+	
+	def move_to(self, x: float=None, y: float=None, z:float =None, concurrent: bool=False):
 		"""Move the stages to an absolute position. `x`, `y` and `z` are
 		in meters.
+		
+		Parameters
+		----------
+		x, y, z: float, optional
+			Position to go to for each coordinate, in meters. If `None`
+			that stage is not moved.
+		concurrent: bool, default False
+			If `False` the stages are moved one after the other, i.e.
+			first `x`, when it arrives `y` and then `z`. If `True` the
+			movement command is sent to all the stages and then it waits
+			for all of them to stop, so the three axes move at the same
+			time and the movement takes as long as the slowest axis.
+		"""
+		self._check_limits(x, y, z) # Check everything before moving anything.
+		self._move_stages([x,y,z], concurrent=concurrent)
+	
+	def _move_stages(self, position, concurrent: bool, relative: bool=False):
+		"""Send the stages to `position`, a list `[x,y,z]` in which
+		the stages with `None` are not moved, and keep track of the 
+		commanded position. If `relative` is `True` then `position` is
+		a displacement. No limits are checked here."""
+		self._command_stages([None if pos is None else stage.calibration.m2steps(pos, relative=relative) for stage,pos in zip(self._stages, position)], concurrent=concurrent, relative=relative)
+	
+	def _command_stages(self, steps, concurrent: bool, relative: bool=False):
+		"""Same as `_move_stages` but `steps` is a list with a tuple 
+		`(steps, usteps)` of integers for each stage, or `None`."""
+		stages_to_move = [(i,stage,steps_usteps) for i,(stage,steps_usteps) in enumerate(zip(self._stages, steps)) if steps_usteps is not None]
+		previous_position = [self._cached_coordinate(i) for i in range(3)]
+		try:
+			self._select_motion_profiles(steps, relative)
+			time_started = time.monotonic()
+			for _,stage,(st,ust) in stages_to_move:
+				if relative:
+					stage._move_rel(st, ust, blocking = not concurrent)
+				else:
+					stage._move_to(st, ust, blocking = not concurrent)
+			if concurrent and len(stages_to_move) > 0:
+				self._wait_for_stop([stage for _,stage,_ in stages_to_move])
+		except:
+			for i,_,_ in stages_to_move: # We don't know where these stages ended.
+				self._position_cache[i] = None
+			raise
+		duration = time.monotonic() - time_started
+		if self._update_position_cache(steps, relative, previous_position):
+			self._verify_position_cache([i for i,_,_ in stages_to_move])
+		if concurrent and len(stages_to_move) > 0:
+			self._record_move_duration(previous_position, duration)
+	
+	def _record_move_duration(self, previous_position, duration: float):
+		"""Give the real duration of a movement in which all the stages 
+		moved at the same time, from `previous_position` to the current 
+		cached position, to `move_time_model` to refine it."""
+		if self.move_time_model is None:
+			return
+		new_position = [self._cached_coordinate(i) for i in range(3)]
+		if None not in previous_position and None not in new_position:
+			self.move_time_model.record(previous_position, new_position, duration)
+	
+	def _get_move_time_model(self):
+		if self.move_time_model is None:
+			self.move_time_model = MoveTimeModel.from_stages(self)
+		return self.move_time_model
+	
+	def estimate_move_time(self, *, start=None, end):
+		"""Estimate how long it takes to move (with `concurrent=True`) 
+		from `start` to `end`. The first time this is called (or 
+		`estimate_plan_time`) a `MoveTimeModel` is created from the speed
+		and acceleration configured in the stages and stored in the
+		attribute `move_time_model`. From then on, the duration of each 
+		concurrent movement is measured and used to refine the model. The
+		arguments are keyword only, e.g. `estimate_move_time(end=(0,0,0))`.
+		
+		Parameters
+		----------
+		start: array like of shape (3,) or (n_moves, 3), optional
+			Initial `(x,y,z)` positions in meters, by default 
+			`commanded_position`.
+		end: array like of shape (3,) or (n_moves, 3)
+			Final `(x,y,z)` positions in meters.
+		
+		Returns
+		-------
+		time: float or numpy array
+			Time in seconds for each movement.
 		"""
-		for stage, pos, coord in zip(self._stages, [x,y,z], ['x','y','z']):
-			if pos == None:
+		if start is None:
+			start = self.commanded_position
+		return self._get_move_time_model().estimate_move_time(start, end)
+	
+	def estimate_plan_time(self, plan, start=None):
+		"""Estimate how long it takes to go through all the points of a 
+		scan plan (see `plan_scan`), without counting the time spent in
+		each point. See also `estimate_move_time`.
+		
+		Parameters
+		----------
+		plan: array like of shape (n_points, 3)
+			The `(x,y,z)` points, in meters.
+		start: array like of shape (3,), optional
+			Where the stages are before starting, by default 
+			`commanded_position`.
+		
+		Returns
+		-------
+		time: float
+			Total time in seconds.
+		"""
+		if start is None:
+			start = self.commanded_position
+		return self._get_move_time_model().estimate_plan_time(plan, start=start)
+	
+	@property
+	def wait_for_stop_settings(self):
+		"""Default arguments for `wait_for_stop` (see the function with
+		that name in this module) used when waiting for the stages to 
+		arrive, e.g. `{'poll_interval': 1e-3, 'timeout': 10, 'settle_time': 5e-3}`.
+		Setting this sets `Stage.wait_for_stop_settings` of each stage. 
+		With the default `{}` each stage is waited by the controller 
+		library."""
+		return self.x_stage.wait_for_stop_settings
+	@wait_for_stop_settings.setter
+	def wait_for_stop_settings(self, settings: dict):
+		if not isinstance(settings, dict):
+			raise TypeError(f'`settings` must be a dictionary, received object of type {type(settings)}.')
+		for stage in self._stages:
+			stage.wait_for_stop_settings = dict(settings)
+	
+	def _wait_for_stop(self, stages):
+		"""Wait for all `stages` to stop, using `wait_for_stop_settings`."""
+		if len(self.wait_for_stop_settings) == 0:
+			for stage in stages:
+				stage.wait_for_stop()
+		else:
+			wait_for_stop(stages, **self.wait_for_stop_settings)
+	
+	def _select_motion_profiles(self, steps, relative: bool):
+		"""Set the motion profile of each stage that is about to move 
+		according to `fast_traverse_threshold`. `steps` and `relative` are
+		as in `_command_stages`."""
+		if self.fast_traverse_threshold is None:
+			return
+		for i,(stage,steps_usteps) in enumerate(zip(self._stages, steps)):
+			if steps_usteps is None:
 				continue
-			if not self.coordinates_limits[coord][0] <= pos <= self.coordinates_limits[coord][1]:
-				raise ValueError(f'Coordinate {repr(coord)} must be inside the range {self.coordinates_limits[coord]}, received {pos}.')
-			stage.move_to(pos,blocking=True)
+			if relative:
+				distance = abs(stage.calibration.steps2m(*steps_usteps))
+			else:
+				current_position = self._cached_coordinate(i)
+				if current_position is None: # Read it only from this stage, as in `AsyncTCTStages` each stage is called from its own thread.
+					current_position, stopped = stage._read_position_and_stopped()
+					if stopped:
+						self._position_cache[i] = current_position
+						self._position_cache_commands_count[i] = stage._movement_commands_count
+				distance = abs(stage.calibration.steps2m(*steps_usteps)-current_position)
+			stage.use_motion_profile('fast-traverse' if distance > self.fast_traverse_threshold else 'precise')
+	
+	def _update_position_cache(self, steps, relative: bool, previous_position=None):
+		"""Store in the cache the position to which the stages were 
+		commanded by `_command_stages(steps, relative=relative)`. For 
+		relative movements `previous_position` is the cached position 
+		before the movement. Returns `True` if it is time to verify the
+		cache according to `verify_position_every`."""
+		moved_something = False
+		for i,(stage,steps_usteps) in enumerate(zip(self._stages, steps)):
+			if steps_usteps is None:
+				continue
+			moved_something = True
+			if relative:
+				self._position_cache[i] = None if previous_position[i] is None else previous_position[i] + stage.calibration.steps2m(*steps_usteps)
+			else:
+				self._position_cache[i] = stage.calibration.steps2m(*steps_usteps) # This is where the stage really goes.
+			self._position_cache_commands_count[i] = stage._movement_commands_count
+		if self.verify_position_every is not None and moved_something:
+			self._moves_since_last_verification += 1
+			return self._moves_since_last_verification >= self.verify_position_every
+		return False
+	
+	def _verify_position_cache(self, indices=(0,1,2)):
+		"""Compare the cached position of the stages number `indices` 
+		with the one read from them, warn if they differ and update the
+		cache. The other stages are not touched."""
+		cached_position = [self._cached_coordinate(i) for i in indices]
+		real_position = self._refresh(indices)
+		for i, cached, real in zip(indices, cached_position, real_position):
+			stage, coord = self._stages[i], 'xyz'[i]
+			if cached is not None and abs(cached-real) > stage.calibration.steps2m(0,1):
+				warnings.warn(f'Stage {repr(coord)} was commanded to {cached} m but it is at {real} m.')
 	
-	def move_rel(self, x=None, y=None, z=None):
+	def _cached_coordinate(self, i: int):
+		"""Return the cached commanded position of the stage number `i`,
+		or `None` if it is not known or if the stage was moved by someone
+		else since it was cached."""
+		if self._position_cache_commands_count[i] != self._stages[i]._movement_commands_count:
+			return None
+		return self._position_cache[i]
+	
+	def invalidate_position_cache(self):
+		"""Forget the cached commanded position of all the stages, so
+		the next relative movement will read it from the stages."""
+		self._position_cache = [None]*3
+		self._position_cache_commands_count = [None]*3
+		self._moves_since_last_verification = 0
+	
+	def refresh(self):
+		"""Read the position from the stages and store it in the cache 
+		of the commanded position. Useful if the stages were moved by
+		some external agent, e.g. by another program.
+		
+		Returns
+		-------
+		position: tuple of float
+			The current position `(x,y,z)` in meters.
+		"""
+		return tuple(self._refresh((0,1,2)))
+	
+	def _refresh(self, indices):
+		"""Same as `refresh` but only for the stages number `indices`, 
+		returns a list with their positions. The other stages are not 
+		touched, so they can be in use by another thread (see `TCTServer`)."""
+		readings = [self._stages[i]._read_position_and_stopped() for i in indices]
+		self._set_position_cache([position if stopped else None for position,stopped in readings], indices) # A stage that is still moving is not where it was commanded to.
+		return [position for position,stopped in readings]
+	
+	def _set_position_cache(self, position, indices=(0,1,2)):
+		"""Store `position`, just read from the stages number `indices`,
+		as their commanded position. Coordinates that are `None` (e.g. of
+		stages that are still moving) stay unknown. Used by `refresh` and
+		by `AsyncTCTStages`."""
+		for i,pos in zip(indices, position):
+			self._position_cache[i] = pos
+			self._position_cache_commands_count[i] = self._stages[i]._movement_commands_count
+		self._moves_since_last_verification = 0
+	
+	@property
+	def commanded_position(self):
+		"""Return the position `(x,y,z)` in meters to which the stages
+		were last commanded. This does not communicate with the stages 
+		unless the position is not known (e.g. after `reset_position` or
+		if a stage was moved directly using `x_stage`, `y_stage` or 
+		`z_stage`), in which case it is read from them.
+		"""
+		return tuple(self._commanded_coordinates((0,1,2)))
+	
+	def _commanded_coordinates(self, indices):
+		"""Return a list `[x,y,z]` with the commanded position of the 
+		stages number `indices` and `None` for the others. Only the 
+		stages in `indices` whose position is not known are read."""
+		position = [self._cached_coordinate(i) if i in indices else None for i in range(3)]
+		unknown = [i for i in indices if position[i] is None]
+		if len(unknown) > 0:
+			for i,pos in zip(unknown, self._refresh(unknown)):
+				position[i] = pos
+		return position
+	
+	def move_rel(self, x=None, y=None, z=None, concurrent: bool=True):
 		"""Move the stages relative to the current position. `x`, `y` and
-		`z` are in meters.
+		`z` are in meters. For `concurrent` see `move_to`, note that here
+		it is `True` by default so all the axes of a jog or a step of a
+		scan move at the same time. This uses the
+		relative movement command of the stages, so nothing is read from 
+		them as long as `commanded_position` is known, which is also 
+		used to check the `coordinates_limits`.
+		"""
+		displacement = [None if xyz is None or stage.calibration.m2steps(xyz, relative=True) == (0,0) else xyz for stage,xyz in zip(self._stages, [x,y,z])]
+		if all(d is None for d in displacement):
+			return
+		current_position = self._commanded_coordinates([i for i,d in enumerate(displacement) if d is not None]) # Only the stages that move are read, if needed.
+		self._check_limits(*[None if d is None else pos+d for pos,d in zip(current_position, displacement)])
+		self._move_stages(displacement, concurrent=concurrent, relative=True)
+	
+	def plan_scan(self, x=None, y=None, z=None, points=None, serpentine: bool=True, move_time=None):
+		"""Produce the list of points that `scan` will visit, and check
+		that all of them are within `coordinates_limits`.
+		
+		Parameters
+		----------
+		x, y, z: float or array like of float, optional
+			Values for each coordinate, in meters. If an array is given
+			the coordinate is scanned through those values, if a number
+			is given the coordinate is kept fixed at that value and if
+			`None` the coordinate is kept at its current position. The
+			points are ordered as in nested loops with `x` the outermost
+			and `z` the innermost coordinate.
+		points: array like of shape (n_points, 3), optional
+			Instead of `x`, `y` and `z` an explicit list of `(x,y,z)`
+			points can be given. They will be visited in the given order.
+		serpentine: bool, default True
+			If `True` the grid is traversed as a serpentine (boustrophedon)
+			so there is no flyback at the end of each row. Ignored if
+			`points` is given.
+		move_time: callable, optional
+			If given together with `points`, the points are reordered to
+			minimize the total travel time according to this time model,
+			starting from the current position. See `optimize_scan_order`
+			in `scan_planning.py`.
+		
+		Returns
+		-------
+		plan: numpy array
+			Array of shape `(n_points, 3)` with the `(x,y,z)` position of
+			each point, in meters, in the order they will be visited.
+		"""
+		if points is not None:
+			if any(xyz is not None for xyz in [x,y,z]):
+				raise ValueError(f'Either `points` or `x`, `y`, `z` can be given, but not both.')
+			plan = np.array(points, dtype=float)
+			if plan.ndim != 2 or plan.shape[1] != 3:
+				raise ValueError(f'`points` must be an array of shape (n_points, 3), received array of shape {plan.shape}.')
+			if move_time is not None:
+				plan, _, _ = optimize_scan_order(plan, move_time, start=self.commanded_position)
+		else:
+			if all(xyz is None for xyz in [x,y,z]):
+				raise ValueError(f'At least one of `x`, `y` or `z` has to be given.')
+			for xyz,coord in zip([x,y,z], ['x','y','z']):
+				if xyz is not None and np.size(xyz) == 0:
+					raise ValueError(f'`{coord}` is empty, it must have at least one position.')
+			current_position = self.commanded_position if any(xyz is None for xyz in [x,y,z]) else None
+			axes = [current_position[i] if xyz is None else xyz for i,xyz in enumerate([x,y,z])]
+			plan = serpentine_grid(*axes, serpentine=serpentine)
+		for i,coord in enumerate(['x','y','z']):
+			outside = (plan[:,i] < self.coordinates_limits[coord][0]) | (plan[:,i] > self.coordinates_limits[coord][1])
+			if outside.any():
+				raise ValueError(f'Coordinate {repr(coord)} must be inside the range {self.coordinates_limits[coord]}, but the scan plan has {outside.sum()} points outside it (e.g. {plan[outside][0,i]}).')
+		return plan
+	
+	def plan_approach(self, plan, approach: str='consistent', overshoot=None, direction=None):
+		"""Add to a scan plan the waypoints such that each point is always
+		approached from the same side, and report what this costs. See 
+		`approach_plan` in `scan_planning.py`.
+		
+		Parameters
+		----------
+		plan: array like of shape (n_points, 3)
+			The points, e.g. from `plan_scan`.
+		approach: str, default 'consistent'
+			Either `'fast'` or `'consistent'`.
+		overshoot: float or list of float, optional
+			Distance of the waypoints to the points for each axis, in 
+			meters. By default the antiplay distance of each stage (see
+			`Stage.antiplay`), or 10 µm if it is 0.
+		direction: int or list of int, optional
+			Direction (1 or -1) in which each coordinate has to be moving
+			when arriving to a point. By default the direction of the 
+			antiplay of each stage, so the controller does not have to do
+			its own antiplay movements.
+		
+		Returns
+		-------
+		approach_plan: dict
+			See `approach_plan` in `scan_planning.py`. The estimated extra
+			time uses `move_time_model` or a model built from the current
+			motion profiles of the stages.
 		"""
-		movement_vector = [None]*3
-		for i, xyz in enumerate([x,y,z]):
-			movement_vector[i] = 0 if xyz is None else xyz
-		self.move_to(*list(np.array(self.position)+np.array(movement_vector)))
+		if overshoot is None or direction is None:
+			antiplay = [stage.antiplay for stage in self._stages]
+			if overshoot is None:
+				overshoot = [abs(a) if a != 0 else 10e-6 for a in antiplay]
+			if direction is None:
+				direction = [-1 if a < 0 else 1 for a in antiplay]
+		result = approach_plan(plan, approach, overshoot=overshoot, direction=direction, start=self.commanded_position, move_time=self._get_move_time_model())
+		waypoints = result['points'][~result['is_measurement']]
+		for i,coord in enumerate(['x','y','z']):
+			outside = (waypoints[:,i] < self.coordinates_limits[coord][0]) | (waypoints[:,i] > self.coordinates_limits[coord][1])
+			if outside.any():
+				raise ValueError(f'Coordinate {repr(coord)} must be inside the range {self.coordinates_limits[coord]}, but {outside.sum()} of the approach waypoints are outside it (e.g. {waypoints[outside][0,i]}), reduce the overshoot or change the direction.')
+		return result
+	
+	def scan(self, x=None, y=None, z=None, points=None, serpentine: bool=True, move_time=None, concurrent: bool=True, approach: str='fast'):
+		"""Move the stages through a list of points, yielding after
+		arriving to each of them. The whole plan is built and checked
+		against `coordinates_limits` before moving anything, and only 
+		the stages whose coordinate changes from one point to the next
+		are commanded. Usage example:
+		```
+		for position in stages.scan(x=np.linspace(-1e-3,1e-3,11), y=np.linspace(-1e-3,1e-3,11)):
+			measure_something()
+		```
+		
+		Parameters
+		----------
+		x, y, z, points, serpentine, move_time:
+			See `plan_scan`.
+		concurrent: bool, default True
+			See `move_to`.
+		approach: str, default 'fast'
+			If `'consistent'` each point is approached always from the 
+			same side, passing through extra waypoints when needed, for 
+			better repeatability. See `plan_approach`. If `'fast'` the 
+			points are visited directly.
+		
+		Yields
+		------
+		position: tuple of float
+			The `(x,y,z)` position in meters to which the stages were
+			commanded to go.
+		"""
+		plan = self.plan_scan(x=x, y=y, z=z, points=points, serpentine=serpentine, move_time=move_time)
+		if approach == 'fast':
+			is_measurement = [True]*len(plan)
+		else:
+			approached = self.plan_approach(plan, approach)
+			plan, is_measurement = approached['points'], approached['is_measurement'].tolist()
+		# Convert the whole plan to steps at once, so in the loop only integers are sent to the stages ---
+		plan_in_steps = [stage.calibration.m2steps(plan[:,i]) for i,stage in enumerate(self._stages)]
+		plan_in_steps = list(zip(*[list(zip(steps.tolist(), usteps.tolist())) for steps,usteps in plan_in_steps]))
+		previous_point = [None]*3
+		for point, point_in_steps, measure in zip(plan.tolist(), plan_in_steps, is_measurement):
+			self._command_stages([steps_usteps if steps_usteps != previous_steps_usteps else None for steps_usteps,previous_steps_usteps in zip(point_in_steps, previous_point)], concurrent=concurrent)
+			previous_point = point_in_steps
+			if measure:
+				yield tuple(point)
+	
+	def fly_scan(self, coordinate: str, start: float, end: float, speed: float, sample_interval: float=1e-3, capacity: int=None, run_up: bool=True):
+		"""Move one stage from `start` to `end` at constant `speed` without
+		stopping, while its position is sampled in the background. This
+		function returns as soon as the movement begins, so the data 
+		acquisition can be done meanwhile. The position at which each 
+		trigger happened is then obtained from its timestamp. Usage example:
+		```
+		with stages.fly_scan('x', start=-1e-3, end=1e-3, speed=100e-6) as fly:
+			while fly.is_moving:
+				timestamps.append(time.monotonic())
+				measure_something()
+		x_positions = fly.position_at(timestamps)
+		```
+		
+		Parameters
+		----------
+		coordinate: str
+			Either `'x'`, `'y'` or `'z'`, the stage to move.
+		start, end: float
+			Region to scan, in meters. The stage is first moved to `start`
+			as with `move_to`.
+		speed: float
+			Speed in meters per second.
+		sample_interval: float, default 1e-3
+			Time between samples of the position, in seconds.
+		capacity: int, optional
+			Maximum number of samples, by default enough for the whole
+			movement.
+		run_up: bool, default True
+			If `True` the stage starts before `start` and finishes after
+			`end` such that it is already at `speed` in the whole region 
+			between them, using the acceleration and deceleration of the
+			stage. Otherwise the stage accelerates after `start` and 
+			decelerates before `end`.
+		
+		Returns
+		-------
+		fly_scan: FlyScan
+			Object to wait for the end of the movement and to convert
+			timestamps into positions, see `sampling.py`.
+		"""
+		if coordinate not in {'x','y','z'}:
+			raise ValueError(f'`coordinate` must be one of {{"x","y","z"}}, received {repr(coordinate)}.')
+		if not speed > 0:
+			raise ValueError(f'`speed` must be a positive number, received {repr(speed)}.')
+		i = ['x','y','z'].index(coordinate)
+		stage = self._stages[i]
+		ramps = stage.motion_profile # The scan is done with these acceleration and deceleration, so the run up is computed with them.
+		ramps = {'acceleration': ramps['acceleration'], 'deceleration': ramps['deceleration']}
+		margin = speed**2/2/min(ramps['acceleration'], ramps['deceleration']) if run_up else 0
+		direction = 1 if end >= start else -1
+		run_start, run_end = start - direction*margin, end + direction*margin
+		self._check_limits(**{coordinate: run_start}) # Check everything before moving anything.
+		self._check_limits(**{coordinate: run_end})
+		self.move_to(**{coordinate: run_start})
+		previous_profile = stage.motion_profile # Read after the run up movement, which may change it (see `fast_traverse_threshold`).
+		previous_profile = {key: previous_profile[key] for key in ['speed','acceleration','deceleration']}
+		previous_profile_name = getattr(stage, '_motion_profile_name', None)
+		
+		steps = [None]*3
+		steps[i] = stage.calibration.m2steps(run_end)
+		if capacity is None:
+			expected_duration = abs(run_end-run_start)/speed + speed/ramps['acceleration'] + speed/ramps['deceleration']
+			capacity = max(1000, 2*int(expected_duration/max(sample_interval, 1e-4)))
+		
+		def on_finish(completed: bool):
+			stage.motion_profile = previous_profile
+			stage._motion_profile_name = previous_profile_name # Everything that was changed was restored, so this is again the profile in the stage.
+			if completed:
+				self._update_position_cache(steps, relative=False)
+			else:
+				self.invalidate_position_cache()
+		
+		stage.motion_profile = {'speed': speed, **ramps}
+		sampler = PositionSampler(stage, interval=sample_interval, capacity=capacity)
+		sampler.start()
+		try:
+			stage._move_to(*steps[i], blocking=False)
+		except:
+			sampler.stop()
+			on_finish(completed=False)
+			raise
+		return FlyScan(stage, sampler, on_finish)
 	
 	@property
 	def position(self):
@@ -261,3 +1402,10 @@ class TCTStages:
 		"""
 		for stage in [self.x_stage, self.y_stage, self.z_stage]:
 			stage.reset_position()
+		self._wait_for_stop(self._stages) # So the position is not cached before the homing finishes.
+		self.invalidate_position_cache()
+	
+	def close(self):
+		"""Close the three stages, see `Stage.close`."""
+		for stage in self._stages:
+			stage.close()
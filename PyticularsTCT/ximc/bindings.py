@@ -0,0 +1,113 @@
+"""Signatures of the functions of the ximc library that are used by
+PyticularsTCT, declared once so ctypes does not have to guess the type
+of each argument in each call, and checking of the `Result` codes they
+return, so errors raise an exception instead of being silently ignored.
+"""
+
+import ctypes
+from ctypes import c_int, c_uint, c_char_p, POINTER
+from . import pyximc
+
+DEVICE_UNDEFINED = -1 # What `open_device` returns when it fails.
+
+class XimcError(RuntimeError):
+	"""A function of the ximc library returned an error code."""
+	def __init__(self, function_name: str, result: int, message: str=None):
+		self.function_name = function_name
+		self.result = result
+		if message is None:
+			message = f'`{function_name}` returned {result} ({RESULT_NAMES.get(result, "unknown error code")}).'
+		super().__init__(message)
+
+class XimcNotImplementedError(XimcError):
+	"""The function is not implemented by the controller, `Result.NotImplemented`."""
+
+class XimcValueError(XimcError, ValueError):
+	"""The controller did not accept the values that were sent, `Result.ValueError`."""
+
+class XimcNoDeviceError(XimcError):
+	"""The controller is not connected or cannot be opened, `Result.NoDevice`."""
+
+RESULT_NAMES = {value: name for name,value in vars(pyximc.Result).items() if not name.startswith('_')}
+
+EXCEPTIONS = {
+	pyximc.Result.Error: XimcError,
+	pyximc.Result.NotImplemented: XimcNotImplementedError,
+	pyximc.Result.ValueError: XimcValueError,
+	pyximc.Result.NoDevice: XimcNoDeviceError,
+}
+
+device_t = c_int
+result_t = c_int
+
+SIGNATURES = { # `{function_name: (restype, argtypes)}`, see https://libximc.xisupport.com/doc-en/ximc_8h.html
+	'open_device': (device_t, [c_char_p]),
+	'close_device': (result_t, [POINTER(device_t)]),
+	'command_move': (result_t, [device_t, c_int, c_int]),
+	'command_movr': (result_t, [device_t, c_int, c_int]),
+	'command_homezero': (result_t, [device_t]),
+	'command_stop': (result_t, [device_t]),
+	'command_sstp': (result_t, [device_t]),
+	'command_wait_for_stop': (result_t, [device_t, c_uint]),
+	'get_status': (result_t, [device_t, POINTER(pyximc.status_t)]),
+	'get_position': (result_t, [device_t, POINTER(pyximc.get_position_t)]),
+	'get_serial_number': (result_t, [device_t, POINTER(c_uint)]),
+	'get_device_information': (result_t, [device_t, POINTER(pyximc.device_information_t)]),
+	'get_engine_settings': (result_t, [device_t, POINTER(pyximc.engine_settings_t)]),
+	'set_engine_settings': (result_t, [device_t, POINTER(pyximc.engine_settings_t)]),
+	'get_move_settings': (result_t, [device_t, POINTER(pyximc.move_settings_t)]),
+	'set_move_settings': (result_t, [device_t, POINTER(pyximc.move_settings_t)]),
+	'get_sync_in_settings': (result_t, [device_t, POINTER(pyximc.sync_in_settings_t)]),
+	'set_sync_in_settings': (result_t, [device_t, POINTER(pyximc.sync_in_settings_t)]),
+	'get_sync_out_settings': (result_t, [device_t, POINTER(pyximc.sync_out_settings_t)]),
+	'set_sync_out_settings': (result_t, [device_t, POINTER(pyximc.sync_out_settings_t)]),
+}
+
+def check_result(result: int, function_name: str, arguments=()):
+	"""Raise the `XimcError` that corresponds to `result`, if it is not
+	`Result.Ok`. Otherwise return `result`."""
+	if function_name == 'open_device':
+		if result == DEVICE_UNDEFINED:
+			raise XimcNoDeviceError(function_name, result, f'Cannot open device {repr(arguments[0]) if arguments else ""}, `open_device` returned {result}.')
+		return result
+	if result != pyximc.Result.Ok:
+		raise EXCEPTIONS.get(result, XimcError)(function_name, result)
+	return result
+
+def _errcheck(result, function, arguments):
+	return check_result(result, function.__name__, arguments)
+
+def declare_signatures(lib):
+	"""Set `argtypes`, `restype` and `errcheck` of each function in
+	`SIGNATURES` for `lib`, the ximc library loaded with ctypes. This is
+	done by `pyximc.load_lib`."""
+	for name, (restype, argtypes) in SIGNATURES.items():
+		function = getattr(lib, name)
+		function.restype = restype
+		function.argtypes = argtypes
+		function.errcheck = _errcheck
+
+class CheckedBackend:
+	"""Wraps an object that implements the functions of the ximc library
+	in Python (e.g. a `SimulatedXimc`) so their results are checked in
+	the same way as those of the real library."""
+	def __init__(self, backend):
+		self.backend = backend
+	
+	def __getattr__(self, name):
+		function = getattr(self.backend, name)
+		if name in SIGNATURES:
+			def checked(*arguments):
+				return check_result(function(*arguments), name, arguments)
+			setattr(self, name, checked) # So next time `__getattr__` is not even called.
+			return checked
+		return function
+
+def bind(lib):
+	"""Return `lib` ready to be used by a `Stage`. `lib` is either the
+	ximc library, whose signatures were already declared when it was
+	loaded, or an object implementing its functions in Python, which
+	is wrapped into a `CheckedBackend`."""
+	if isinstance(lib, (ctypes.CDLL, CheckedBackend)):
+		return lib
+	return CheckedBackend(lib)
@@ -3,6 +3,7 @@ import platform
 from pathlib import Path
 import os
 import sys
+import threading
 
 # ----------------------------------------------------------------------
 # This file was adapted from the original one shipped with the ximc 
@@ -15,23 +16,10 @@ def ximc_shared_lib():
 	this_file_path = Path(__file__)
 	if platform.system() == "Linux":
 		path_to_ximc_binaries = this_file_path.parent/Path('debian-amd64')
-		# This will execute only the first time this script is run ---
-		ignoreme_file = this_file_path.parent/Path('path_added_to_bashrc.ignoreme')
-		if not ignoreme_file.is_file():
-			with open(Path.home()/Path('.bashrc'), 'a') as bashrc:
-				print(f'export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:{path_to_ximc_binaries}', file = bashrc)
-			ignoreme_file.touch() # Create this file as a flag for future executions.
-			print(f'''
-##########################################
-    IMPORTANT to complete installation
-##########################################
-Please do one of the following:
-	- Run `source ~/.bashrc` (without the `)
-	- or close this terminal and open a new one
-This is only required the first time you use this module to complete the installation, I could not find other way to automatize this, sorry.
-''')
-			exit()
-		# ------------------------------------------------------------
+		# `libximc.so` depends on these, which are not found by the dynamic linker unless they are in `LD_LIBRARY_PATH`. Loading them first by absolute path and with `RTLD_GLOBAL` makes them available to `libximc.so` ---
+		for dependency in ['libbindy.so', 'libxiwrapper.so']:
+			if (path_to_ximc_binaries/Path(dependency)).is_file():
+				CDLL(str(path_to_ximc_binaries/Path(dependency)), mode=RTLD_GLOBAL)
 		return CDLL(str(path_to_ximc_binaries/Path("libximc.so")))
 	elif platform.system() == "Darwin":
 		raise NotImplementedError(f'Not implemented for your operating system ({platform.system()}). However it should be very easy, have a look at the file {this_file_path.parent/Path("README.md")}.')
@@ -45,7 +33,31 @@ This is only required the first time you use this module to complete the install
 	else:
 		return None
 
-lib = ximc_shared_lib()
+def load_lib():
+	"""Load the shared library, only the first time this is called, and
+	return it. This is what `lib` returns, so the library is only loaded
+	when it is used for the first time and this module can be imported
+	(e.g. to use the data types) in computers without it."""
+	global lib
+	with _load_lib_lock: # Several stages may be opened at the same time from different threads, the library must be loaded only once.
+		if 'lib' not in globals():
+			shared_lib = ximc_shared_lib()
+			if shared_lib is None:
+				raise RuntimeError(f'Cannot load the ximc library, your operating system ({platform.system()}) is not supported.')
+			# Clarify function types (moved here from below, as they need the library) ---
+			shared_lib.enumerate_devices.restype = POINTER(device_enumeration_t)
+			shared_lib.get_device_name.restype = c_char_p
+			from .bindings import declare_signatures # Here and not at the top because it imports this module.
+			declare_signatures(shared_lib) # Signatures and error checking of the functions used by `Stage`.
+			lib = shared_lib # From now on `lib` is a normal attribute of this module and `__getattr__` is not called anymore.
+	return lib
+
+_load_lib_lock = threading.Lock()
+
+def __getattr__(name):
+	if name == 'lib':
+		return load_lib()
+	raise AttributeError(f'module {repr(__name__)} has no attribute {repr(name)}')
 
 # ----------------------------------------------------------------------
 # From here on I did not modified anything, it is the original script.
@@ -84,8 +96,7 @@ class device_network_information_t(LittleEndianStructure):
 
 # Clarify function types
 
-lib.enumerate_devices.restype = POINTER(device_enumeration_t)
-lib.get_device_name.restype = c_char_p
+# `lib.enumerate_devices.restype` and `lib.get_device_name.restype` are set in `load_lib`.
 
 
 
@@ -0,0 +1,172 @@
+"""Measure the cost of each layer of PyticularsTCT: unit conversions,
+calls to the stages, scans, laser configuration and startup. Runs
+against the simulators by default, or against the real setup with
+`--real`. Examples:
+```
+python benchmarks/benchmark.py --output results.json
+python benchmarks/benchmark.py --real --ports /dev/ttyACM0 /dev/ttyACM1 /dev/ttyACM2 --output results_real.json
+```
+The results are printed and saved as JSON, so different versions can
+be compared.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # Use this copy of PyticularsTCT even if it is not installed.
+
+import PyticularsTCT
+from PyticularsTCT.stage import StageCalibration
+from PyticularsTCT.simulation import SimulatedXimc, SimulatedLaserUSBDevice
+
+def latency_distribution(function, repetitions: int, warmup: int=3):
+	"""Call `function()` `repetitions` times and return statistics of
+	the time each call takes, in seconds."""
+	for _ in range(warmup):
+		function()
+	times = np.empty(repetitions)
+	for i in range(repetitions):
+		time_started = time.perf_counter()
+		function()
+		times[i] = time.perf_counter() - time_started
+	return {
+		'n': repetitions,
+		'p50': float(np.percentile(times, 50)),
+		'p99': float(np.percentile(times, 99)),
+		'mean': float(times.mean()),
+		'min': float(times.min()),
+		'max': float(times.max()),
+	}
+
+def benchmark_conversions(repetitions: int):
+	calibration = StageCalibration()
+	array = np.linspace(-1e-3, 1e-3, 1000)
+	return {
+		'm2steps(float)': latency_distribution(lambda: calibration.m2steps(1.234e-3), repetitions),
+		'm2steps(array of 1000)': latency_distribution(lambda: calibration.m2steps(array), repetitions),
+		'steps2m(int, int)': latency_distribution(lambda: calibration.steps2m(493, 150), repetitions),
+	}
+
+def benchmark_stages(tct, repetitions: int):
+	stages = tct.stages
+	stage = stages.x_stage
+	stages.move_to(0, 0, stages.coordinates_limits['z'][0])
+	results = {
+		'Stage.get_status(tuple)': latency_distribution(lambda: stage.get_status(format='tuple'), repetitions),
+		'Stage.position': latency_distribution(lambda: stage.position, repetitions),
+		'TCTStages.position': latency_distribution(lambda: stages.position, repetitions),
+		'TCTStages.commanded_position': latency_distribution(lambda: stages.commanded_position, repetitions),
+	}
+	direction = [1]
+	def move_one_step():
+		stages.move_rel(x=direction[0]*stage.calibration.meters_per_step, concurrent=True)
+		direction[0] *= -1
+	results['TCTStages.move_rel(1 step)'] = latency_distribution(move_one_step, max(1, repetitions//10))
+	return results
+
+def benchmark_scans(tct, grid_sizes, step: float):
+	results = {}
+	for n in grid_sizes:
+		axis = np.arange(n)*step
+		time_started = time.perf_counter()
+		n_points = sum(1 for _ in tct.stages.scan(x=axis, y=axis))
+		elapsed = time.perf_counter() - time_started
+		results[f'{n}x{n} raster, {step*1e6:g} µm pitch'] = {
+			'points': n_points,
+			'seconds': elapsed,
+			'points_per_second': n_points/elapsed,
+		}
+	return results
+
+def benchmark_laser(tct, repetitions: int):
+	laser = tct.laser
+	laser.on()
+	settings = [(1e3, 0), (2e3, 100)]
+	i = [0]
+	def reconfigure():
+		frequency, DAC = settings[i[0]%2]
+		laser.set(frequency=frequency, DAC=DAC)
+		i[0] += 1
+	results = {
+		'ParticularsLaserController.status': latency_distribution(lambda: laser.status, repetitions),
+		'ParticularsLaserController._send_packet': latency_distribution(lambda: laser._send_packet([91]), repetitions),
+		'ParticularsLaserController.set(frequency, DAC)': latency_distribution(reconfigure, repetitions),
+	}
+	results['reconfigurations_per_second'] = 1/results['ParticularsLaserController.set(frequency, DAC)']['mean']
+	laser.off()
+	return results
+
+def git_revision():
+	try:
+		return subprocess.run(['git','rev-parse','HEAD'], cwd=Path(__file__).parent, capture_output=True, text=True, check=True).stdout.strip()
+	except Exception:
+		return None
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark PyticularsTCT against the simulators or the real setup.')
+	parser.add_argument('--real', action='store_true', help='Use the real stages and laser instead of the simulators.')
+	parser.add_argument('--ports', nargs=3, metavar=('X','Y','Z'), help='Ports of the stages, required with --real.')
+	parser.add_argument('--stage-latency', type=float, default=1e-3, help='Latency of each call to the simulated stages, in seconds. Default 1e-3.')
+	parser.add_argument('--laser-latency', type=float, default=1e-4, help='Latency of each transfer to the simulated laser, in seconds. Default 1e-4.')
+	parser.add_argument('--repetitions', type=int, default=200, help='Repetitions for each latency measurement. Default 200.')
+	parser.add_argument('--grid-sizes', type=int, nargs='+', default=[5,10], help='Size of the n x n raster scans. Default 5 10.')
+	parser.add_argument('--scan-step', type=float, default=10e-6, help='Distance between the points of the raster scans, in meters. Default 10e-6.')
+	parser.add_argument('--output', default='benchmark_results.json', help='Where to save the results. Default benchmark_results.json.')
+	args = parser.parse_args()
+	
+	if args.real:
+		if args.ports is None:
+			parser.error('--ports is required with --real')
+		ports = args.ports
+		def create_tct():
+			return PyticularsTCT.TCT(*ports)
+	else:
+		ports = ['sim/x','sim/y','sim/z']
+		stages_backend = SimulatedXimc(latency=args.stage_latency)
+		def create_tct():
+			return PyticularsTCT.TCT(*ports, stages_backend=stages_backend, laser_device=SimulatedLaserUSBDevice(latency=args.laser_latency))
+	
+	print('Measuring startup...')
+	time_started = time.perf_counter()
+	tct = create_tct()
+	startup_time = time.perf_counter() - time_started
+	results = {
+		'metadata': {
+			'date': datetime.now().isoformat(),
+			'git_revision': git_revision(),
+			'python': sys.version,
+			'platform': platform.platform(),
+			'backend': 'real' if args.real else 'simulated',
+			'arguments': vars(args),
+		},
+		'startup': {'TCT()': startup_time, **{f'TCT.startup_times[{repr(name)}]': t for name,t in tct.startup_times.items()}},
+	}
+	print('Measuring unit conversions...')
+	results['conversions'] = benchmark_conversions(args.repetitions)
+	print('Measuring stages...')
+	results['stages'] = benchmark_stages(tct, args.repetitions)
+	print('Measuring scans...')
+	results['scans'] = benchmark_scans(tct, args.grid_sizes, args.scan_step)
+	print('Measuring laser...')
+	results['laser'] = benchmark_laser(tct, max(1, args.repetitions//10))
+	tct.stages.close()
+	
+	for section in ['startup','conversions','stages','scans','laser']:
+		print(f'\n{section} ---')
+		for name, value in results[section].items():
+			if isinstance(value, dict) and 'p50' in value:
+				print(f'{name}: p50 = {value["p50"]*1e6:.1f} µs, p99 = {value["p99"]*1e6:.1f} µs')
+			elif isinstance(value, dict):
+				print(f'{name}: {value["points_per_second"]:.1f} points/s ({value["points"]} points in {value["seconds"]:.2f} s)')
+			else:
+				print(f'{name}: {value:.4g}')
+	with open(args.output, 'w') as ofile:
+		json.dump(results, ofile, indent=2)
+	print(f'\nResults saved in {args.output}')
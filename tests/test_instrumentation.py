@@ -0,0 +1,36 @@
+import pytest
+from PyticularsTCT import ParticularsLaserController
+from PyticularsTCT.instrumentation import Instrumentation
+from PyticularsTCT.stage import Stage
+from PyticularsTCT.simulation import SimulatedLaserUSBDevice, SimulatedXimc, VirtualClock
+
+def test_laser_cannot_be_attached_twice():
+	laser = ParticularsLaserController(device=SimulatedLaserUSBDevice())
+	device = laser.device
+	with Instrumentation().attach(laser):
+		with pytest.raises(RuntimeError):
+			Instrumentation().attach(laser)
+	assert laser.device is device
+	assert '_send_packet' not in vars(laser)
+	laser.on()
+
+def test_detach_restores_send_packet_of_the_instance():
+	laser = ParticularsLaserController(device=SimulatedLaserUSBDevice())
+	sent = []
+	def send_packet(packet):
+		sent.append(packet)
+	laser._send_packet = send_packet
+	with Instrumentation().attach(laser):
+		pass
+	assert laser._send_packet is send_packet
+
+def test_stage_cannot_be_attached_twice():
+	stage = Stage('sim/instrumentation', backend=SimulatedXimc(clock=VirtualClock()))
+	try:
+		lib = stage._lib
+		with Instrumentation().attach(stage):
+			with pytest.raises(RuntimeError):
+				Instrumentation().attach(stage)
+		assert stage._lib is lib
+	finally:
+		stage.close()
@@ -0,0 +1,59 @@
+import threading
+import pytest
+from PyticularsTCT import ParticularsLaserController
+from PyticularsTCT.server import TCTServer, TCTClient
+from PyticularsTCT.simulation import SimulatedLaserUSBDevice
+
+@pytest.fixture
+def client(tmp_path):
+	device = SimulatedLaserUSBDevice()
+	server = TCTServer(laser=ParticularsLaserController(device=device), socket_path=tmp_path/'server.sock')
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	client = TCTClient(socket_path=tmp_path/'server.sock')
+	yield client, device
+	client.close()
+	server.close()
+	thread.join()
+
+def test_laser_state_of_new_server(client):
+	client, device = client
+	assert client.laser.status == ('on' if device.is_on else 'off')
+	assert client.laser.frequency == pytest.approx(50, rel=1e-2)
+	assert client.laser.DAC == 0
+
+def test_laser_set_round_trip(client):
+	client, device = client
+	client.laser.set(frequency=1e3)
+	assert client.laser.frequency == pytest.approx(1e3, rel=1e-2)
+	client.laser.set(DAC=100, status='on')
+	assert client.laser.status == 'on'
+	assert client.laser.DAC == 100
+	assert device.is_on and device.DAC == 100
+	client.laser.off()
+	assert client.laser.status == 'off'
+	assert not device.is_on
+
+def test_stages_moved_by_two_clients_at_the_same_time(tmp_path):
+	from PyticularsTCT.stage import TCTStages
+	from PyticularsTCT.simulation import SimulatedXimc
+	stages = TCTStages('sim/server_x', 'sim/server_y', 'sim/server_z', backend=SimulatedXimc(latency=1e-4), verify_position_every=1)
+	server = TCTServer(stages=stages, socket_path=tmp_path/'server.sock')
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	try:
+		def move(coord):
+			with TCTClient(socket_path=tmp_path/'server.sock') as client:
+				for _ in range(5):
+					client.stages.move_rel(**{coord: 10e-6})
+		threads = [threading.Thread(target=move, args=(coord,)) for coord in ['x','y']]
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+		with TCTClient(socket_path=tmp_path/'server.sock') as client:
+			assert client.stages.commanded_position == pytest.approx((50e-6, 50e-6, 0), abs=1e-7)
+	finally:
+		server.close()
+		thread.join()
+		stages.close()
@@ -0,0 +1,50 @@
+import ctypes
+from PyticularsTCT.simulation import SimulatedXimc, VirtualClock
+from PyticularsTCT.ximc import pyximc
+
+def _status(ximc, device_id):
+	status = pyximc.status_t()
+	assert ximc.get_status(device_id, ctypes.byref(status)) == pyximc.Result.Ok
+	return status
+
+def _is_moving(status):
+	return bool(status.MoveSts & pyximc.MoveState.MOVE_STATE_MOVING or status.MvCmdSts & pyximc.MvcmdStatus.MVCMD_RUNNING)
+
+def test_move_while_moving_replaces_the_target():
+	clock = VirtualClock()
+	ximc = SimulatedXimc(clock=clock)
+	device_id = ximc.open_device(b'sim/x')
+	ximc.command_move(device_id, 1000, 0)
+	clock.advance(.5)
+	ximc.command_move(device_id, -100, 0)
+	status = _status(ximc, device_id)
+	assert status.CmdBufFreeSpace == ximc.command_buffer_size
+	ximc.command_wait_for_stop(device_id, 10)
+	status = _status(ximc, device_id)
+	assert not _is_moving(status)
+	assert (status.CurPosition, status.uCurPosition) == (-100, 0)
+	assert clock() < 3 # Going first to 1000 would take more than 3 s with the default settings.
+
+def test_move_while_moving_is_queued_with_queue_commands():
+	clock = VirtualClock()
+	ximc = SimulatedXimc(clock=clock, queue_commands=True)
+	device_id = ximc.open_device(b'sim/x')
+	ximc.command_move(device_id, 1000, 0)
+	clock.advance(.5)
+	ximc.command_move(device_id, -100, 0)
+	status = _status(ximc, device_id)
+	assert status.CmdBufFreeSpace == ximc.command_buffer_size-1
+	ximc.command_wait_for_stop(device_id, 10)
+	status = _status(ximc, device_id)
+	assert not _is_moving(status)
+	assert (status.CurPosition, status.uCurPosition) == (-100, 0)
+	assert clock() > 5 # It went first to 1000.
+
+def test_homezero_returns_when_homing_is_finished():
+	ximc = SimulatedXimc(clock=VirtualClock())
+	device_id = ximc.open_device(b'sim/x')
+	ximc.command_move(device_id, 1000, 0)
+	assert ximc.command_homezero(device_id) == pyximc.Result.Ok
+	status = _status(ximc, device_id)
+	assert not _is_moving(status)
+	assert (status.CurPosition, status.uCurPosition) == (0, 0)
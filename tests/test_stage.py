@@ -0,0 +1,27 @@
+import pytest
+from PyticularsTCT.stage import Stage, wait_for_stop
+from PyticularsTCT.simulation import SimulatedXimc, VirtualClock
+
+@pytest.fixture(params=[False, True], ids=['replace target','queue commands'])
+def stage(request):
+	stage = Stage('sim/test', backend=SimulatedXimc(clock=VirtualClock(), queue_commands=request.param))
+	yield stage
+	stage.close()
+
+def test_stream_moves_visits_every_target(stage):
+	targets = [10e-6, 20e-6, 0, 30e-6]
+	for i in stage.stream_moves(targets, poll_interval=0):
+		position, speed, is_moving, _ = stage.get_status(format='tuple')
+		assert position == pytest.approx(targets[i], abs=stage.calibration.meters_per_step)
+	assert not is_moving and speed == 0
+
+def test_wait_for_stop_stops_the_stage_on_timeout():
+	stage = Stage('sim/test', backend=SimulatedXimc(latency=1e-4)) # In real time, so the timeout happens while moving.
+	try:
+		stage.move_to(5e-3, blocking=False)
+		with pytest.raises(TimeoutError):
+			wait_for_stop([stage], timeout=.2)
+		wait_for_stop([stage])
+		assert stage.position < 1e-3 # It would take seconds to get to 5 mm.
+	finally:
+		stage.close()